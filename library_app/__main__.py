@@ -0,0 +1,362 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import date
+
+# Add the app directory to path, as the pages do
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from core import (
+    DATA_DIR, CirculationError,
+    get_storage, get_datasets, get_circulation, get_repository, get_archive,
+    get_book_search, get_isbn_index, get_open_loans,
+    load_users, load_books, load_settings, load_stats, rebuild_stats, checkpoint_data,
+    archive_issues, run_archive_policy, run_audit_retention, disable_archiver,
+    get_backups, start_backup, legacy_backups, restore_backup, book_import
+)
+from core.bulk import FORMATS, RowError, batched, date_field, float_field, int_field, read_rows, text_field
+from core.catalogue import BATCH_SIZE as IMPORT_BATCH_SIZE
+from core.overdue import count_overdue, days_overdue, fine_due
+
+# Command-line tool for the jobs otherwise done from the admin pages, on the
+# same data directory and through the same data layer as the app:
+#
+#   python -m library_app import catalogue.csv  (title, author, isbn, category, stock)
+#   python -m library_app issue loans.csv       (username, book_id or isbn, issue_date)
+#   python -m library_app return returns.jsonl  (issue_id or code, return_date, fine_paid)
+#   python -m library_app overdue --output overdue.csv
+#   python -m library_app fines
+#   python -m library_app reindex
+#   python -m library_app archive [--before 2024-01-01] [--audit]
+#   python -m library_app backup | backups | restore BACKUP_ID
+#   python -m library_app stats [--json]
+#
+# Bulk files are read a row at a time and committed in batches, so their
+# size doesn't matter. A row that can't be used is reported on stderr with
+# its line number and the rest carry on; the exit status is 1 if any failed.
+
+BATCH_SIZE = 1000
+
+
+def _fail(line_no, message):
+    print(f"line {line_no}: {message}", file=sys.stderr)
+
+
+def _run_batch(circulation, batch):
+    """(line number, result or CirculationError) for a batch of (line number, transaction)."""
+    transactions = [transaction for line_no, transaction in batch]
+    try:
+        results = circulation.run_all(transactions)
+    except CirculationError:
+        # The batch kept colliding with desks at work: commit its rows one at a time
+        results = []
+        for transaction in transactions:
+            try:
+                results += circulation.run_all([transaction])
+            except CirculationError as error:
+                results.append(error)
+    return zip((line_no for line_no, transaction in batch), results)
+
+
+def _run_file(args, transaction_for, verb):
+    """Run the transaction for each row of the input file, a batch at a time."""
+    circulation = get_circulation()
+    done = failed = 0
+    for rows in batched(read_rows(args.file, args.format), args.batch_size):
+        batch = []
+        errors = []
+        for line_no, row in rows:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                batch.append((line_no, transaction_for(circulation, row)))
+            except RowError as error:
+                errors.append((line_no, error))
+        for line_no, result in _run_batch(circulation, batch):
+            if isinstance(result, CirculationError):
+                errors.append((line_no, result))
+            else:
+                done += 1
+        for line_no, error in sorted(errors, key=lambda entry: entry[0]):
+            _fail(line_no, error)
+        failed += len(errors)
+    print(f"{verb} {done} loans" + (f", {failed} rows failed" if failed else ""))
+    return 1 if failed else 0
+
+
+def _issuing(circulation, row):
+    username = text_field(row, 'username')
+    if 'book_id' in row:
+        book_id = int_field(row, 'book_id')
+    elif 'isbn' in row:
+        isbn = text_field(row, 'isbn')
+        book_id = get_isbn_index().book_id(isbn)
+        if book_id is None:
+            raise RowError(f"There is no book with ISBN {isbn}")
+    else:
+        raise RowError("book_id or isbn is required")
+    return circulation.issuing(username, book_id, date_field(row, 'issue_date'))
+
+
+def _returning(circulation, row):
+    if 'issue_id' in row:
+        issue_id = int_field(row, 'issue_id')
+    else:
+        issue_id = _scanned_issue(text_field(row, 'code'))
+    return circulation.returning(issue_id, date_field(row, 'return_date'), float_field(row, 'fine_paid'))
+
+
+def _scanned_issue(code):
+    # An issue id, or the ISBN of a book with exactly one copy on loan
+    if code.isdigit():
+        issue, stamp = get_storage().read('issues', int(code))
+        if issue is not None and issue['return_date'] is None:
+            return issue['id']
+    book_id = get_isbn_index().book_id(code)
+    issue_ids = get_open_loans().for_book(book_id) if book_id is not None else []
+    if not issue_ids:
+        raise RowError(f"No open loan matches {code}")
+    if len(issue_ids) > 1:
+        raise RowError(f"{len(issue_ids)} copies of this book are on loan: give the issue ID")
+    return issue_ids[0]
+
+
+def cmd_issue(args):
+    return _run_file(args, _issuing, "Issued")
+
+
+def cmd_return(args):
+    return _run_file(args, _returning, "Returned")
+
+
+def cmd_import(args):
+    importer = book_import(args.batch_size)
+    for line_no, message in importer.run(read_rows(args.file, args.format)):
+        _fail(line_no, message)
+    print(f"Imported {importer.added} books"
+          + (f", {importer.skipped} duplicate ISBNs skipped" if importer.skipped else "")
+          + (f", {importer.failed} rows failed" if importer.failed else ""))
+    return 1 if importer.failed else 0
+
+
+def _output(args):
+    if args.output in (None, '-'):
+        return open(sys.stdout.fileno(), 'w', encoding='utf-8', newline='', closefd=False)
+    return open(args.output, 'w', encoding='utf-8', newline='')
+
+
+def cmd_overdue(args):
+    repo = get_repository()
+    fine_per_day = load_settings()['fine_per_day']
+    count = total = 0
+    with _output(args) as f:
+        writer = csv.writer(f)
+        writer.writerow(['issue_id', 'username', 'book_id', 'title', 'issue_date', 'due_date', 'days_overdue', 'fine'])
+        for issue in repo.overdue_issues(args.date):
+            book = repo.book(issue['book_id'])
+            fine = fine_due(issue, args.date, fine_per_day)
+            writer.writerow([issue['id'], issue['username'], issue['book_id'], book['title'] if book else '',
+                             issue['issue_date'], issue['expected_return_date'],
+                             days_overdue(issue, args.date), f"{fine:.2f}"])
+            count += 1
+            total += fine
+    print(f"{count} overdue loans, ${total:.2f} in fines", file=sys.stderr)
+    return 0
+
+
+def cmd_fines(args):
+    repo = get_repository()
+    users = load_users()
+    fine_per_day = load_settings()['fine_per_day']
+    owed = defaultdict(lambda: [0, 0.0])
+    for issue in repo.overdue_issues(args.date):
+        entry = owed[issue['username']]
+        entry[0] += 1
+        entry[1] += fine_due(issue, args.date, fine_per_day)
+    with _output(args) as f:
+        writer = csv.writer(f)
+        writer.writerow(['username', 'name', 'email', 'overdue_loans', 'fine'])
+        for username, (loans, fine) in sorted(owed.items(), key=lambda item: -item[1][1]):
+            user = users.get(username) or {}
+            name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
+            writer.writerow([username, name, user.get('email', ''), loans, f"{fine:.2f}"])
+    print(f"{len(owed)} users owe ${sum(fine for loans, fine in owed.values()):.2f}", file=sys.stderr)
+    return 0
+
+
+def _timed(label, step):
+    started = time.perf_counter()
+    result = step()
+    print(f"{label} ({time.perf_counter() - started:.2f}s)")
+    return result
+
+
+def cmd_reindex(args):
+    _timed("Recounted the dashboard statistics", rebuild_stats)
+    _timed("Folded pending changes into the data files", checkpoint_data)
+    # Build every index from scratch, so one that is slow or fails shows up here
+    get_datasets().invalidate()
+    _timed("Built the book, issue and due-date indexes", get_repository)
+    _timed("Built the catalogue search index", get_book_search)
+    _timed("Built the ISBN and open-loan lookups", lambda: (get_isbn_index(), get_open_loans()))
+    return 0
+
+
+def cmd_archive(args):
+    if args.before:
+        archived = archive_issues(returned_before=args.before)
+    else:
+        archived = run_archive_policy()
+    print(f"Archived {archived} returned loans")
+    if args.audit:
+        print(f"Compacted {run_audit_retention()} days of the audit log")
+    return 0
+
+
+def cmd_backup(args):
+    progress = start_backup()
+    stage = None
+    while not progress.finished:
+        if progress.stage != stage:
+            stage = progress.stage
+            print(f"{stage}...", file=sys.stderr)
+        time.sleep(0.1)
+    if progress.error:
+        print(f"Backup failed: {progress.error}", file=sys.stderr)
+        return 1
+    manifest = get_backups().manifest(progress.backup_id)
+    print(f"Backup created: {progress.backup_id} "
+          f"({manifest['new_chunks']} of {manifest['chunks']} chunks new, {manifest['stored_bytes'] / 1024:.1f} KB stored)")
+    return 0
+
+
+def cmd_backups(args):
+    store = get_backups()
+    for backup_id in store.backups():
+        manifest = store.manifest(backup_id)
+        print(f"{backup_id}  {manifest['bytes'] / 1024:.1f} KB of data, {manifest['stored_bytes'] / 1024:.1f} KB new when taken")
+    for backup_id in legacy_backups():
+        print(f"{backup_id}  (pickle copy)")
+    return 0
+
+
+def cmd_restore(args):
+    if args.backup_id not in get_backups().backups() and args.backup_id not in legacy_backups():
+        print(f"There is no backup {args.backup_id} (see: python -m library_app backups)", file=sys.stderr)
+        return 1
+    restore_backup(args.backup_id)
+    print(f"Backup '{args.backup_id}' restored")
+    return 0
+
+
+def cmd_stats(args):
+    storage = get_storage()
+    stats = load_stats()
+    users = load_users()
+    books = load_books()
+    today = date.today()
+    summary = {
+        'storage': type(storage).__name__,
+        'data_dir': str(DATA_DIR),
+        'users': len(users),
+        'active_users': stats['active_users'],
+        'titles': stats['total_books'],
+        'copies': sum(book['stock'] for book in books),
+        'books_on_loan': stats['books_on_loan'],
+        'open_loans': sum(stats['open_by_due_date'].values()),
+        'overdue_loans': count_overdue(stats, today),
+        'archived_loans': get_archive().read(['id']).num_rows,
+        'backups': len(get_backups().backups()),
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for key, value in summary.items():
+            print(f"{key.replace('_', ' ').capitalize():<16}{value}")
+    return 0
+
+
+def _date_arg(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a date (YYYY-MM-DD)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m library_app", description="Library management jobs")
+    commands = parser.add_subparsers(dest='command', required=True, metavar='COMMAND')
+
+    command = commands.add_parser('import', help="add the books listed in a file to the catalogue",
+                                  description="Add the books listed in a file to the catalogue (columns: title, author, "
+                                              "isbn, category, stock; MARC tags 245, 100, 020 and 650 also work). "
+                                              "Books whose ISBN is already in the catalogue are skipped.")
+    command.add_argument('file', help="CSV or JSON-lines file ('-' for standard input)")
+    command.add_argument('--format', choices=FORMATS, help="file format (default: from the file name; csv for stdin)")
+    command.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                         help=f"books committed together (default: {IMPORT_BATCH_SIZE})")
+    command.set_defaults(handler=cmd_import)
+
+    for name, handler, help, columns in (
+        ('issue', cmd_issue, "issue the loans listed in a file", "username, book_id or isbn, issue_date"),
+        ('return', cmd_return, "return the loans listed in a file", "issue_id or code, return_date, fine_paid"),
+    ):
+        command = commands.add_parser(name, help=help, description=f"{help.capitalize()} (columns: {columns}).")
+        command.add_argument('file', help="CSV or JSON-lines file ('-' for standard input)")
+        command.add_argument('--format', choices=FORMATS, help="file format (default: from the file name; csv for stdin)")
+        command.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f"rows committed together (default: {BATCH_SIZE})")
+        command.set_defaults(handler=handler)
+
+    for name, handler, help in (
+        ('overdue', cmd_overdue, "list overdue loans with the fines they have run up, as CSV"),
+        ('fines', cmd_fines, "total the fines owed by each user, as CSV"),
+    ):
+        command = commands.add_parser(name, help=help)
+        command.add_argument('--date', type=_date_arg, default=date.today(), help="count as of this date (default: today)")
+        command.add_argument('--output', '-o', help="file to write (default: standard output)")
+        command.set_defaults(handler=handler)
+
+    command = commands.add_parser('reindex', help="recount the statistics and rebuild the indexes")
+    command.set_defaults(handler=cmd_reindex)
+
+    command = commands.add_parser('archive', help="move returned loans into the archive")
+    command.add_argument('--before', type=_date_arg, help="archive loans returned before this date (default: as the settings say)")
+    command.add_argument('--audit', action='store_true', help="also compact old audit log days as the settings say")
+    command.set_defaults(handler=cmd_archive)
+
+    command = commands.add_parser('backup', help="back up the data and the issue archive")
+    command.set_defaults(handler=cmd_backup)
+
+    command = commands.add_parser('backups', help="list the backups")
+    command.set_defaults(handler=cmd_backups)
+
+    command = commands.add_parser('restore', help="replace the data with a backup's")
+    command.add_argument('backup_id', help="backup to restore (see: backups)")
+    command.set_defaults(handler=cmd_restore)
+
+    command = commands.add_parser('stats', help="show dataset statistics")
+    command.add_argument('--json', action='store_true', help="print them as JSON")
+    command.set_defaults(handler=cmd_stats)
+
+    args = parser.parse_args(argv)
+    # A one-off job: archive only when the archive command asks for it
+    disable_archiver()
+    if getattr(args, 'batch_size', 1) < 1:
+        parser.error("--batch-size must be at least 1")
+    try:
+        return args.handler(args)
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head): stop without a traceback
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except (OSError, ValueError) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
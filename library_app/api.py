@@ -0,0 +1,22 @@
+import argparse
+
+from core.api import DEFAULT_PORT, serve
+
+# JSON HTTP API for kiosks and scanners (see core/api.py for the endpoints):
+#
+#   python library_app/api.py --port 8502
+#
+# It can run next to the Streamlit app on the same data directory.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Library circulation API")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    args = parser.parse_args()
+    print(f"Serving the library API on http://{args.host}:{args.port}")
+    serve(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
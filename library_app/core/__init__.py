@@ -0,0 +1,24 @@
+# Core data layer for the library app.
+#
+# Importing this package has no side effects: the data files are opened on
+# first use. The Streamlit helpers live in core.auth and core.ui so the data
+# layer can also be used without Streamlit.
+from .data import (
+    DATA_DIR,
+    get_storage, get_datasets,
+    load_users, save_users,
+    load_books, save_books,
+    load_issues, save_issues,
+    load_settings, save_settings,
+    load_stats, rebuild_stats, migrate_data,
+    read_record, get_repository, get_reports, get_book_search, get_isbn_index, get_open_loans,
+    search_books, search_users, search_open_issues,
+    get_sorted_view, page_ids,
+    add_book, book_import,
+    get_circulation, issue_book, return_book, renew_issue,
+    get_archive, archive_issues, run_archive_policy, disable_archiver,
+    get_audit_log, add_audit_log, load_audit_logs, run_audit_retention,
+    get_backups, start_backup, backup_progress, legacy_backups, restore_backup,
+    checkpoint_data
+)
+from .circulation import CirculationError
@@ -0,0 +1,280 @@
+import base64
+import json
+import re
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .audit import set_actor
+from .circulation import CirculationError
+from .data import (
+    get_book_search, get_isbn_index, get_open_loans, get_storage,
+    issue_book, load_settings, load_users, renew_issue, return_book
+)
+from .overdue import fine_due
+
+# JSON over HTTP for self-checkout kiosks and barcode scanners, served from
+# the same data directory as the Streamlit app. Requests go straight to the
+# process-wide storage engine and the incrementally kept indexes (search,
+# ISBNs, open loans), so no request loads a whole dataset; loans go through
+# the same circulation transactions as the Issue/Return page.
+#
+#   GET  /health
+#   GET  /books/search?q=...&limit=20
+#   GET  /books/<id>
+#   GET  /books/isbn/<isbn>
+#   POST /issues               {"username", "book_id" or "isbn", "issue_date"?}
+#   POST /issues/<id>/return   {"return_date"?, "fine_paid"?}
+#   POST /issues/<id>/renew
+#   POST /returns              {"code": scanned issue id or ISBN, "return_date"?, "fine_paid"?}
+#
+# Circulation endpoints need HTTP basic auth as an active admin user.
+
+DEFAULT_PORT = 8502
+
+# Most search results returned at once
+MAX_LIMIT = 100
+
+BOOK_FIELDS = ('id', 'title', 'author', 'isbn', 'category', 'stock', 'available')
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _book_json(book):
+    return {field: book.get(field) for field in BOOK_FIELDS}
+
+
+def _book(book_id):
+    book, stamp = get_storage().read('books', book_id)
+    if book is None:
+        raise ApiError(404, f"There is no book with ID {book_id}")
+    return book
+
+
+def _book_id_for_isbn(isbn):
+    book_id = get_isbn_index().book_id(isbn)
+    if book_id is None:
+        raise ApiError(404, f"There is no book with ISBN {isbn}")
+    return book_id
+
+
+def _date(body, field):
+    value = body.get(field)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{field} must be a date (YYYY-MM-DD)")
+
+
+def _number(body, field, default):
+    value = body.get(field, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ApiError(400, f"{field} must be a non-negative number")
+    return float(value)
+
+
+def health(match, query, body):
+    return 200, {'status': 'ok'}
+
+
+def search(match, query, body):
+    text = query.get('q', [''])[0]
+    if not text.strip():
+        raise ApiError(400, "q is required")
+    try:
+        limit = min(int(query.get('limit', ['20'])[0]), MAX_LIMIT)
+    except ValueError:
+        raise ApiError(400, "limit must be a number")
+    if limit < 1:
+        raise ApiError(400, "limit must be at least 1")
+    storage = get_storage()
+    books = (storage.read('books', book_id)[0] for book_id in get_book_search().search(text, limit))
+    return 200, {'books': [_book_json(book) for book in books if book is not None]}
+
+
+def book(match, query, body):
+    return 200, {'book': _book_json(_book(int(match.group(1))))}
+
+
+def book_by_isbn(match, query, body):
+    return 200, {'book': _book_json(_book(_book_id_for_isbn(match.group(1))))}
+
+
+def issue(match, query, body):
+    username = body.get('username')
+    if not isinstance(username, str) or not username:
+        raise ApiError(400, "username is required")
+    if 'book_id' in body:
+        if isinstance(body['book_id'], bool) or not isinstance(body['book_id'], int):
+            raise ApiError(400, "book_id must be a number")
+        book_id = body['book_id']
+    elif isinstance(body.get('isbn'), str):
+        book_id = _book_id_for_isbn(body['isbn'])
+    else:
+        raise ApiError(400, "book_id or isbn is required")
+    return 201, {'issue': issue_book(username, book_id, _date(body, 'issue_date'))}
+
+
+def _return(issue_id, body):
+    return_date = _date(body, 'return_date') or date.today()
+    fine_paid = _number(body, 'fine_paid', 0.0)
+    loan, stamp = get_storage().read('issues', issue_id)
+    if loan is None:
+        raise ApiError(404, f"There is no issue with ID {issue_id}")
+    fine = fine_due(loan, return_date, load_settings()['fine_per_day'])
+    returned = return_book(issue_id, return_date, min(fine_paid, fine))
+    return 200, {'issue': returned, 'fine': fine}
+
+
+def return_issue(match, query, body):
+    return _return(int(match.group(1)), body)
+
+
+def return_scanned(match, query, body):
+    """Return the loan a scanned code stands for: an issue id, or the ISBN of a book with one open loan."""
+    code = body.get('code')
+    if not isinstance(code, str) or not code.strip():
+        raise ApiError(400, "code is required")
+    code = code.strip()
+    if code.isdigit():
+        loan, stamp = get_storage().read('issues', int(code))
+        if loan is not None and loan['return_date'] is None:
+            return _return(loan['id'], body)
+    book_id = get_isbn_index().book_id(code)
+    issue_ids = get_open_loans().for_book(book_id) if book_id is not None else []
+    if not issue_ids:
+        raise ApiError(404, f"No open loan matches {code}")
+    if len(issue_ids) > 1:
+        return 409, {'error': f"{len(issue_ids)} copies of this book are on loan: scan the issue ID",
+                     'issues': issue_ids}
+    return _return(issue_ids[0], body)
+
+
+def renew(match, query, body):
+    issue_id = int(match.group(1))
+    loan, stamp = get_storage().read('issues', issue_id)
+    if loan is None:
+        raise ApiError(404, f"There is no issue with ID {issue_id}")
+    return 200, {'issue': renew_issue(issue_id)}
+
+
+# (method, path, handler, whether it needs an admin login)
+ROUTES = [
+    ('GET', re.compile(r'/health'), health, False),
+    ('GET', re.compile(r'/books/search'), search, False),
+    ('GET', re.compile(r'/books/(\d+)'), book, False),
+    ('GET', re.compile(r'/books/isbn/([^/]+)'), book_by_isbn, False),
+    ('POST', re.compile(r'/issues'), issue, True),
+    ('POST', re.compile(r'/issues/(\d+)/return'), return_issue, True),
+    ('POST', re.compile(r'/issues/(\d+)/renew'), renew, True),
+    ('POST', re.compile(r'/returns'), return_scanned, True),
+]
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    # Keep connections open between requests, as kiosks send many, and send
+    # each response at once rather than waiting to fill a packet
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "LibraryAPI/1.0"
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        try:
+            body = self._body() if method == 'POST' else {}
+            routes = [route for route in ROUTES if route[1].fullmatch(url.path)]
+            if not routes:
+                raise ApiError(404, "Not found")
+            route = next((route for route in routes if route[0] == method), None)
+            if route is None:
+                raise ApiError(405, "Method not allowed")
+            _, pattern, handler, admin = route
+            # Changes are logged in the audit log under the authenticated user
+            set_actor(self._authenticate() if admin else None)
+            status, payload = handler(pattern.fullmatch(url.path), parse_qs(url.query), body)
+        except ApiError as error:
+            status, payload = error.status, {'error': error.message}
+        except CirculationError as error:
+            status, payload = 409, {'error': str(error)}
+        except Exception:
+            self.log_error("Error handling %s %s", method, self.path)
+            status, payload = 500, {'error': "Internal error"}
+        self._send(status, payload)
+
+    def _body(self):
+        length = self.headers.get('Content-Length') or '0'
+        if not length.strip().isdigit():
+            # Where this body ends can't be told, so neither can where the next request starts
+            self.close_connection = True
+            raise ApiError(400, "Content-Length must be a non-negative whole number")
+        length = int(length)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(400, "The request body must be JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "The request body must be a JSON object")
+        return body
+
+    def _authenticate(self):
+        header = self.headers.get('Authorization', '')
+        if header.startswith('Basic '):
+            try:
+                username, password = base64.b64decode(header[6:]).decode('utf-8').split(':', 1)
+            except ValueError:
+                username, password = None, None
+            user = load_users().get(username)
+            if user and user['password'] == password and user['active'] and user['role'] == 'admin':
+                return username
+        raise ApiError(401, "Log in as an admin user")
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, default=_json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if status == 401:
+            self.send_header('WWW-Authenticate', 'Basic realm="library"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_request(self, code='-', size='-'):
+        # No access log line per request; errors are still logged
+        pass
+
+
+def make_server(host='127.0.0.1', port=DEFAULT_PORT):
+    """An HTTP server for the API, one thread per connection."""
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(host='127.0.0.1', port=DEFAULT_PORT):
+    # Open the data and build the indexes before the first request needs them
+    get_storage()
+    get_book_search()
+    get_isbn_index()
+    get_open_loans()
+    make_server(host, port).serve_forever()
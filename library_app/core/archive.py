@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Returned issues are moved out of the row store into Arrow IPC files, one
+# directory per month of issue date (month=YYYY-MM). Files are written once
+# and read through a memory map, so a report only pages in the months and
+# columns it actually uses. Dates are stored as day ordinals (0 = no date).
+#
+# Each append adds a part file to the months it touches. Once a month has
+# more than MAX_PARTS of them they are merged into one file, named after the
+# newest part it holds (merged-<part>.arrow); parts no newer than that are
+# ignored from then on and deleted, so a reader never sees a record twice.
+
+# Part files a month may have before they are merged
+MAX_PARTS = 4
+
+PART_PREFIX = 'part-'
+MERGED_PREFIX = 'merged-'
+
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('username', pa.dictionary(pa.int32(), pa.string())),
+    ('book_id', pa.int64()),
+    ('issue_day', pa.int32()),
+    ('expected_day', pa.int32()),
+    ('return_day', pa.int32()),
+    ('fine_paid', pa.float64()),
+    ('status', pa.dictionary(pa.int32(), pa.string())),
+])
+
+
+def _ordinal(value):
+    return value.toordinal() if value is not None else 0
+
+
+def _date(ordinal):
+    return date.fromordinal(ordinal) if ordinal else None
+
+
+def _table(issues):
+    return pa.table({
+        'id': pa.array([issue['id'] for issue in issues], pa.int64()),
+        'username': pa.array([issue['username'] for issue in issues], pa.string()).dictionary_encode(),
+        'book_id': pa.array([issue['book_id'] for issue in issues], pa.int64()),
+        'issue_day': pa.array([_ordinal(issue['issue_date']) for issue in issues], pa.int32()),
+        'expected_day': pa.array([_ordinal(issue['expected_return_date']) for issue in issues], pa.int32()),
+        'return_day': pa.array([_ordinal(issue['return_date']) for issue in issues], pa.int32()),
+        'fine_paid': pa.array([issue['fine_paid'] or 0.0 for issue in issues], pa.float64()),
+        'status': pa.array([issue['status'] for issue in issues], pa.string()).dictionary_encode(),
+    }, schema=SCHEMA)
+
+
+class IssueArchive:
+    """Returned issue records, stored column-wise and partitioned by issue month."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def months(self):
+        """Archived months ('YYYY-MM'), oldest first."""
+        if not self.path.exists():
+            return []
+        return sorted(entry.name[len('month='):] for entry in self.path.iterdir()
+                      if entry.is_dir() and entry.name.startswith('month='))
+
+    def _files(self, month):
+        # The month's current files: the newest merged file, if any, and the parts written after it
+        paths = sorted((self.path / f"month={month}").glob('*.arrow'))
+        merged = [path for path in paths if path.name.startswith(MERGED_PREFIX)]
+        if not merged:
+            return paths
+        covered = merged[-1].stem[len(MERGED_PREFIX):]
+        return [merged[-1]] + [path for path in paths if path.name.startswith(PART_PREFIX) and path.stem > covered]
+
+    def version(self):
+        """Changes whenever a file is added to the archive."""
+        return tuple(path.name for month in self.months() for path in self._files(month))
+
+    def _write(self, path, table):
+        # Write under a temporary name and rename, so readers never see half a file
+        tmp = path.with_suffix('.tmp')
+        with pa.OSFile(str(tmp), 'wb') as sink:
+            with pa.ipc.new_file(sink, SCHEMA) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+
+    def _merge(self, month):
+        # Rewrite the month's files as one, then delete what it replaces
+        directory = self.path / f"month={month}"
+        paths = self._files(month)
+        table = pa.concat_tables(self._read_month(month))
+        newest = max(path.stem for path in paths if path.name.startswith(PART_PREFIX))
+        # Dictionaries differ from part to part; unify them so the file holds one table
+        self._write(directory / f"{MERGED_PREFIX}{newest}.arrow", table.unify_dictionaries().combine_chunks())
+        current = set(self._files(month))
+        for path in directory.glob('*.arrow'):
+            if path not in current:
+                path.unlink(missing_ok=True)
+
+    def _read_month(self, month):
+        while True:
+            try:
+                return [pa.ipc.open_file(pa.memory_map(str(path))).read_all() for path in self._files(month)]
+            except FileNotFoundError:
+                # Merged into one file since they were listed: list them again
+                continue
+
+    def append(self, issues):
+        """Write issue records to the archive, one new file per month, merging a month's files once there are many."""
+        by_month = {}
+        for issue in issues:
+            by_month.setdefault(issue['issue_date'].strftime('%Y-%m'), []).append(issue)
+        with self._lock:
+            for month, month_issues in by_month.items():
+                directory = self.path / f"month={month}"
+                directory.mkdir(parents=True, exist_ok=True)
+                # Unique across processes, and in write order when sorted
+                self._write(directory / f"{PART_PREFIX}{time.time_ns()}-{os.getpid()}.arrow", _table(month_issues))
+                if len(self._files(month)) > MAX_PARTS:
+                    self._merge(month)
+
+    def read(self, columns=None, start=None, end=None):
+        """Archived issues as an Arrow table, memory-mapped.
+
+        Only the months from start to end (dates, both optional) are opened,
+        and only the given columns are kept.
+        """
+        first = start.strftime('%Y-%m') if start else None
+        last = end.strftime('%Y-%m') if end else None
+        schema = SCHEMA if columns is None else pa.schema([SCHEMA.field(name) for name in columns])
+        tables = []
+        for month in self.months():
+            if (first and month < first) or (last and month > last):
+                continue
+            for table in self._read_month(month):
+                tables.append(table if columns is None else table.select(columns))
+        if not tables:
+            return schema.empty_table()
+        return pa.concat_tables(tables)
+
+    def ids(self):
+        return set(self.read(['id']).column('id').to_pylist())
+
+    def last_id(self):
+        ids = self.read(['id']).column('id')
+        return pc.max(ids).as_py() if len(ids) else 0
+
+    def records(self, start=None, end=None, ids=None):
+        """Archived issues as issue records (dicts with date values), optionally only those with the given ids."""
+        table = self.read(start=start, end=end)
+        if ids is not None:
+            table = table.filter(pc.is_in(table.column('id'), value_set=pa.array(list(ids), pa.int64())))
+        table = table.to_pydict()
+        return [{
+            'id': table['id'][row],
+            'username': table['username'][row],
+            'book_id': table['book_id'][row],
+            'issue_date': _date(table['issue_day'][row]),
+            'expected_return_date': _date(table['expected_day'][row]),
+            'return_date': _date(table['return_day'][row]),
+            'fine_paid': table['fine_paid'][row],
+            'status': table['status'][row],
+        } for row in range(len(table['id']))]
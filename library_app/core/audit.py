@@ -0,0 +1,536 @@
+import atexit
+import gzip
+import json
+import os
+import queue
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, time
+from pathlib import Path
+
+from .dates import now, to_datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Audit trail. Entries are appended as JSON lines to one segment file per day
+# (YYYY-MM-DD.jsonl) and never rewritten. record() only puts an entry on a
+# queue; a background thread writes whatever has queued up in one go and
+# fsyncs each segment once per batch, so auditing costs the caller next to
+# nothing however long the log grows. Queries open only the segments of the
+# days they cover and binary-search the timestamps within them.
+
+# Who changes made outside a logged-in session (background jobs) are logged as
+SYSTEM_USER = 'system'
+
+# Most entries written (and fsynced) together
+MAX_BATCH = 1000
+
+# Parsed day segments kept in memory
+CACHED_SEGMENTS = 64
+
+# Segment files: plain (still open for appends), compressed, or rolled up into
+# per-day counts. A file being compacted carries a .compacting suffix.
+ROLLUP_KIND = 'rollup.json'
+SEGMENT_KINDS = ('jsonl', 'jsonl.gz', 'jsonl.zst', ROLLUP_KIND)
+COMPACTING = '.compacting'
+
+# Compression for segments past the hot period; zstd needs the optional zstandard package
+COMPRESSIONS = {'gzip': 'jsonl.gz'}
+if zstandard is not None:
+    COMPRESSIONS['zstd'] = 'jsonl.zst'
+
+# Per-day action and username counts, so the filter lists don't need the whole log
+SUMMARY_FILE = 'summary.json'
+
+# A save touching more records than this is logged as one summary entry per action
+MAX_DETAILED = 100
+
+# Datasets whose changes are logged
+AUDITED_DATASETS = ('books', 'users', 'issues', 'settings')
+
+_actor = threading.local()
+_summary = threading.local()
+
+
+def set_actor(username):
+    """Log changes made by this thread (one Streamlit script run) as username."""
+    _actor.username = username
+
+
+def current_actor():
+    return getattr(_actor, 'username', None) or SYSTEM_USER
+
+
+@contextmanager
+def audited_as(action):
+    """Log what this thread saves in the block as one action entry with record
+    counts, rather than an entry per record (e.g. loans moved to the archive)."""
+    _summary.action = action
+    try:
+        yield
+    finally:
+        _summary.action = None
+
+
+def _line(entry):
+    return json.dumps(dict(entry, timestamp=str(entry['timestamp']))) + '\n'
+
+
+class AuditLog:
+    """Append-only audit log in daily segments, written by a background thread."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._writer = None
+        # Parsed segments, least recently used first
+        self._segments = OrderedDict()
+        self._summary_lock = threading.Lock()
+        self._summaries = None
+
+    def record(self, action, details, username=None):
+        """Queue an entry; it reaches the disk shortly after, on the writer thread."""
+        self._queue.put({
+            'timestamp': now(),
+            'username': username or current_actor(),
+            'action': action,
+            'details': details
+        })
+        if self._writer is None:
+            self._start_writer()
+
+    def flush(self):
+        """Wait until every entry recorded so far is on disk."""
+        self._queue.join()
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="audit-writer", daemon=True)
+                self._writer.start()
+                # Entries still queued when the app stops are written on the way out
+                atexit.register(self.flush)
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except OSError:
+                # Keep the writer alive; the next batch tries again
+                pass
+            finally:
+                for entry in batch:
+                    self._queue.task_done()
+
+    def write(self, entries):
+        """Append entries to their day's segment, with one fsync per segment."""
+        by_day = {}
+        for entry in entries:
+            by_day.setdefault(entry['timestamp'].date().isoformat(), []).append(_line(entry))
+        with self._lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            for day, lines in sorted(by_day.items()):
+                with open(self.path / f"{day}.jsonl", 'a', encoding='utf-8') as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def _raw_files(self):
+        """{day: [(path, kind)]} of every segment file in the log directory."""
+        files = {}
+        if self.path.exists():
+            for path in self.path.iterdir():
+                day, dot, kind = path.name.partition('.')
+                if _base_kind(kind) in SEGMENT_KINDS:
+                    try:
+                        files.setdefault(date.fromisoformat(day), []).append((path, kind))
+                    except ValueError:
+                        continue
+        return files
+
+    def _files(self):
+        """{day: [segment files to read]}.
+
+        Files being compacted are renamed *.compacting first; once the
+        compacted file is in place they are duplicates and are left out.
+        """
+        files = {}
+        for day, entries in self._raw_files().items():
+            compacted = any(not kind.endswith(COMPACTING) and kind != 'jsonl' for path, kind in entries)
+            files[day] = sorted(path for path, kind in entries if not (compacted and kind.endswith(COMPACTING)))
+        return files
+
+    def days(self):
+        """Days with a segment, oldest first."""
+        return sorted(self._files())
+
+    def _signature(self, paths):
+        return tuple((path.name, path.stat().st_size) for path in paths)
+
+    def _segment(self, day, paths=None):
+        """The parsed segment of a day; a segment still being appended to is
+        topped up with just its new lines."""
+        paths = paths or self._files().get(day, [])
+        signature = self._signature(paths)
+        with self._lock:
+            segment = self._segments.pop(day, None)
+            if segment is None or not segment.continues(signature):
+                segment = _Segment()
+                for path in paths:
+                    segment.load(path)
+            elif segment.signature != signature:
+                segment.read_from(paths[0], signature[0][1])
+            segment.signature = signature
+            self._segments[day] = segment
+            while len(self._segments) > CACHED_SEGMENTS:
+                self._segments.popitem(last=False)
+            return segment
+
+    def _summary(self, day, paths):
+        # {'size', 'actions', 'usernames'} of a day, recounted only when its files changed
+        size = sum(size for name, size in self._signature(paths))
+        summary = self._summaries.get(day.isoformat())
+        if summary is None or summary['size'] != size:
+            segment = self._segment(day, paths)
+            summary = {'size': size, 'actions': dict(segment.actions), 'usernames': dict(segment.usernames)}
+            self._summaries[day.isoformat()] = summary
+            self._summaries_changed = True
+        return summary
+
+    def _load_summaries(self):
+        if self._summaries is None:
+            try:
+                with open(self.path / SUMMARY_FILE, encoding='utf-8') as f:
+                    self._summaries = json.load(f)
+            except (OSError, ValueError):
+                self._summaries = {}
+            self._summaries_changed = False
+
+    def _save_summaries(self):
+        if self._summaries_changed:
+            tmp = self.path / (SUMMARY_FILE + '.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._summaries, f)
+            os.replace(tmp, self.path / SUMMARY_FILE)
+            self._summaries_changed = False
+
+    def distinct(self):
+        """({action: entry count}, {username: entry count}) over the whole log.
+
+        Counts per day are kept in a summary file next to the segments, so
+        this reads only the segments written to since it was last saved.
+        """
+        self.flush()
+        with self._summary_lock:
+            self._load_summaries()
+            actions, usernames = Counter(), Counter()
+            for day, paths in self._files().items():
+                summary = self._summary(day, paths)
+                actions.update(summary['actions'])
+                usernames.update(summary['usernames'])
+            self._save_summaries()
+            return dict(actions), dict(usernames)
+
+    def query(self, start=None, end=None, action=None, username=None, newest_first=False):
+        """Entries from start to end, optionally of one action and/or user.
+
+        start and end are datetimes or dates (a date covers the whole day),
+        both optional. Only the segments of days in range are read, and only
+        entries between the two times are looked at. Entries recorded before
+        the call are included, even if still queued.
+        """
+        self.flush()
+        if isinstance(start, date) and not isinstance(start, datetime):
+            start = datetime.combine(start, time.min)
+        if isinstance(end, date) and not isinstance(end, datetime):
+            end = datetime.combine(end, time.max)
+        files = self._files()
+        days = [day for day in sorted(files, reverse=newest_first)
+                if (start is None or day >= start.date()) and (end is None or day <= end.date())]
+
+        if action is not None or username is not None:
+            # Skip the days without the action or user, going by the day summaries
+            with self._summary_lock:
+                self._load_summaries()
+                days = [day for day in days
+                        if (action is None or action in self._summary(day, files[day])['actions'])
+                        and (username is None or username in self._summary(day, files[day])['usernames'])]
+                self._save_summaries()
+
+        entries = []
+        for day in days:
+            segment = self._segment(day, files[day])
+            low = 0 if start is None else bisect_left(segment.timestamps, start)
+            high = len(segment.timestamps) if end is None else bisect_right(segment.timestamps, end)
+            matches = [entry for entry in segment.entries[low:high]
+                       if (action is None or entry['action'] == action)
+                       and (username is None or entry['username'] == username)]
+            entries.extend(reversed(matches) if newest_first else matches)
+        return entries
+
+    def read(self, start=None, end=None):
+        """Entries from start to end (dates, both optional), oldest first."""
+        return self.query(start, end)
+
+    def apply_retention(self, today, hot_days, compression='gzip', rollup_days=0):
+        """Compact the segments of past days.
+
+        Days more than hot_days old are compressed, days more than rollup_days
+        old are replaced by per-day counts of each action and user (0 = never
+        for either). Compacted days stay readable by query(). Returns the
+        number of days compacted.
+        """
+        self.flush()
+        compressed = COMPRESSIONS.get(compression, COMPRESSIONS['gzip'])
+        count = 0
+        for day, entries in sorted(self._raw_files().items()):
+            age = (today - day).days
+            kinds = {kind for path, kind in entries}
+            if (rollup_days and age > rollup_days) or ROLLUP_KIND in kinds:
+                kind = ROLLUP_KIND
+            elif hot_days and age > hot_days:
+                kind = compressed
+            else:
+                continue
+            done = len(entries) == 1 and (kinds == {kind} or (kind == compressed and kinds <= set(COMPRESSIONS.values())))
+            if not done:
+                self._compact(day, entries, kind)
+                count += 1
+        return count
+
+    def _compact(self, day, entries, kind):
+        # Rename the day's files out of the way, write them as one file of the
+        # given kind, then delete them
+        if any(not k.endswith(COMPACTING) and k != 'jsonl' for path, k in entries):
+            # An earlier compaction finished writing; only its leftovers remain
+            for path, k in entries:
+                if k.endswith(COMPACTING):
+                    path.unlink()
+            entries = [(path, k) for path, k in entries if not k.endswith(COMPACTING)]
+        with self._lock:
+            sources = []
+            for path, k in entries:
+                if not k.endswith(COMPACTING):
+                    path = path.replace(path.with_name(path.name + COMPACTING))
+                sources.append(path)
+            self._segments.pop(day, None)
+
+        target = self.path / f"{day.isoformat()}.{kind}"
+        tmp = target.with_name(target.name + '.tmp')
+        if kind == ROLLUP_KIND:
+            counts = Counter()
+            for path in sources:
+                if _base_kind(path.name.partition('.')[2]) == ROLLUP_KIND:
+                    with open(path, encoding='utf-8') as f:
+                        for action, username, n in json.load(f)['counts']:
+                            counts[action, username] += n
+                else:
+                    segment = _Segment()
+                    segment.load(path)
+                    counts.update((entry['action'], entry['username']) for entry in segment.entries)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'day': day.isoformat(),
+                           'counts': [[action, username, n] for (action, username), n in sorted(counts.items())]}, f)
+        else:
+            segment = _Segment()
+            for path in sources:
+                segment.load(path)
+            data = ''.join(_line(entry) for entry in segment.entries).encode('utf-8')
+            with (gzip.open(tmp, 'wb') if kind == 'jsonl.gz' else zstandard.open(tmp, 'wb')) as f:
+                f.write(data)
+        os.replace(tmp, target)
+        for path in sources:
+            path.unlink()
+
+    def disk_usage(self):
+        """{'hot' | 'compressed' | 'rollup': (days, bytes)} of the segment files."""
+        usage = {}
+        for day, paths in self._files().items():
+            for path in paths:
+                kind = _base_kind(path.name.partition('.')[2])
+                group = 'hot' if kind == 'jsonl' else 'rollup' if kind == ROLLUP_KIND else 'compressed'
+                days, size = usage.get(group, (0, 0))
+                usage[group] = (days + 1, size + path.stat().st_size)
+        return usage
+
+
+class _Segment:
+    """One day's entries with their timestamps in order, and the distinct
+    actions and usernames in it with their counts."""
+
+    def __init__(self):
+        self.entries = []
+        self.timestamps = []
+        self.actions = Counter()
+        self.usernames = Counter()
+        self.size = 0
+        self.signature = ()
+
+    def continues(self, signature):
+        # Whether signature is this segment's single plain file, grown or unchanged
+        return (self.signature == signature) or (
+            len(signature) == 1 and len(self.signature) == 1 and signature[0][0].endswith('.jsonl')
+            and signature[0][0] == self.signature[0][0] and signature[0][1] >= self.size)
+
+    def load(self, path):
+        kind = _base_kind(path.name.partition('.')[2])
+        if kind == 'jsonl':
+            self.size = 0
+            self.read_from(path, path.stat().st_size)
+        elif kind == ROLLUP_KIND:
+            with open(path, encoding='utf-8') as f:
+                rollup = json.load(f)
+            timestamp = datetime.combine(date.fromisoformat(rollup['day']), time.min)
+            self._add([{'timestamp': timestamp, 'username': username, 'action': action,
+                        'details': f"{count} entries (daily rollup)"}
+                       for action, username, count in rollup['counts']],
+                      [count for action, username, count in rollup['counts']])
+        else:
+            with _open_compressed(path) as f:
+                self._add(_parse(f.read()))
+
+    def read_from(self, path, size):
+        with open(path, 'rb') as f:
+            f.seek(self.size)
+            data = f.read(size - self.size)
+        # Leave a line still being written for the next read
+        data = data[:data.rfind(b'\n') + 1]
+        self.size += len(data)
+        self._add(_parse(data))
+
+    def _add(self, added, counts=None):
+        # counts: how many entries each of added stands for (rolled-up days)
+        for entry, count in zip(added, counts or [1] * len(added)):
+            self.actions[entry['action']] += count
+            self.usernames[entry['username']] += count
+        if (self.timestamps and added and added[0]['timestamp'] < self.timestamps[-1]) or \
+                any(a['timestamp'] > b['timestamp'] for a, b in zip(added, added[1:])):
+            # Entries from concurrent writers can land slightly out of order
+            self.entries = sorted(self.entries + added, key=lambda entry: entry['timestamp'])
+            self.timestamps = [entry['timestamp'] for entry in self.entries]
+        else:
+            self.entries += added
+            self.timestamps += [entry['timestamp'] for entry in added]
+
+
+def _base_kind(kind):
+    return kind[:-len(COMPACTING)] if kind.endswith(COMPACTING) else kind
+
+
+def _open_compressed(path):
+    if path.name.partition('.')[2].startswith('jsonl.gz'):
+        return gzip.open(path, 'rb')
+    if zstandard is None:
+        raise OSError(f"{path.name} is zstd-compressed; install the zstandard package to read it")
+    return zstandard.open(path, 'rb')
+
+
+def _parse(data):
+    entries = []
+    for line in data.splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # A line cut short by a crash
+            continue
+        entry['timestamp'] = to_datetime(entry['timestamp'])
+        entries.append(entry)
+    return entries
+
+
+def _issue_action(old, issue):
+    if old is None:
+        return "Issue Book"
+    if old['return_date'] is None and issue['return_date'] is not None:
+        return "Return Book"
+    if (issue['return_date'] is None and old['expected_return_date'] != issue['expected_return_date']
+            and dict(old, expected_return_date=issue['expected_return_date']) == issue):
+        return "Renew Book"
+    return "Edit Issue"
+
+
+def _events(name, rows, changed, removed, circulation=False):
+    # (action, details) for each record changed in a dataset. In a circulation
+    # transaction (books and issues saved together) a book whose availability
+    # is all that moved is part of the loan or return, not an edit of its own.
+    if name == 'settings':
+        updates = [f"{key}: {rows.get(key)} -> {value}" for key, value in changed]
+        updates += [f"{key} removed" for key in removed]
+        return [("Update Settings", ", ".join(updates))]
+
+    noun = {'books': "Book", 'users': "User", 'issues': "Issue"}[name]
+
+    def describe(key, record):
+        if name == 'books':
+            return f"Book {key}: {record['title']}"
+        if name == 'issues':
+            return f"Issue {key}: book {record['book_id']}, user {record['username']}"
+        return f"User {key}"
+
+    events = []
+    for key, record in changed:
+        old = rows.get(key)
+        if name == 'issues':
+            action = _issue_action(old, record)
+        elif circulation and old is not None and dict(old, available=record['available']) == record:
+            continue
+        else:
+            action = f"{'Add' if old is None else 'Edit'} {noun}"
+        events.append((action, describe(key, record)))
+    for key in removed:
+        if key in rows:
+            events.append((f"Delete {noun}", describe(key, rows[key])))
+    return events
+
+
+class AuditHook:
+    """Logs every change to books, users, issues and settings once it is committed.
+
+    As a storage hook it works out what each change does while the old
+    records are still there; as a listener it logs those events after the
+    write went through, so a failed save logs nothing.
+    """
+
+    def __init__(self, audit):
+        self.audit = audit
+        self._pending = threading.local()
+
+    def __call__(self, engine, changes):
+        action = getattr(_summary, 'action', None)
+        if action is not None:
+            counts = [f"{len(changed) + len(removed)} {name}" for name, (changed, removed) in changes.items()
+                      if name in AUDITED_DATASETS and (changed or removed)]
+            self._pending.events = [(action, ", ".join(counts))] if counts else []
+            return changes
+        circulation = 'books' in changes and 'issues' in changes
+        events = []
+        for name in AUDITED_DATASETS:
+            if name in changes:
+                events += _events(name, engine._rows_for(name), *changes[name], circulation)
+        self._pending.events = events
+        return changes
+
+    def committed(self, changes, versions):
+        events = getattr(self._pending, 'events', [])
+        self._pending.events = []
+        by_action = {}
+        for action, details in events:
+            by_action.setdefault(action, []).append(details)
+        for action, details in by_action.items():
+            if len(details) > MAX_DETAILED:
+                self.audit.record(action, f"{len(details)} records")
+            else:
+                for text in details:
+                    self.audit.record(action, text)
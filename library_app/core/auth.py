@@ -0,0 +1,51 @@
+import streamlit as st
+
+from .audit import set_actor
+from .data import add_audit_log, load_users
+
+
+# Initialize session state for login status
+def init_session():
+    if 'logged_in' not in st.session_state:
+        st.session_state['logged_in'] = False
+    if 'username' not in st.session_state:
+        st.session_state['username'] = None
+    if 'role' not in st.session_state:
+        st.session_state['role'] = None
+    # Changes saved during this run are logged under the logged-in user
+    set_actor(st.session_state['username'])
+
+# Login function
+def login(username, password):
+    users = load_users()
+    if username in users and users[username]['password'] == password and users[username]['active']:
+        st.session_state['logged_in'] = True
+        st.session_state['username'] = username
+        st.session_state['role'] = users[username]['role']
+        set_actor(username)
+        add_audit_log("Login", f"{username} logged in", username)
+        return True
+    add_audit_log("Failed Login", f"Failed login for '{username}'", username)
+    return False
+
+# Logout function
+def logout():
+    if st.session_state.get('username'):
+        add_audit_log("Logout", f"{st.session_state['username']} logged out", st.session_state['username'])
+    st.session_state['logged_in'] = False
+    st.session_state['username'] = None
+    st.session_state['role'] = None
+
+# Send anyone who isn't a logged-in admin back to the dashboard
+def require_admin():
+    set_actor(st.session_state.get('username'))
+    
+    # Redirect if not logged in
+    if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
+        st.warning("Please login to access this page")
+        st.switch_page("app.py")
+
+    # Check if admin
+    if st.session_state['role'] != 'admin':
+        st.error("You don't have permission to access this page")
+        st.switch_page("app.py")
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+# Content-addressed backups. A backup is split into chunks, each stored once
+# under the SHA-256 of its contents, compressed; a manifest per backup lists
+# the chunks it is made of. Records are chunked by key, with chunk boundaries
+# wherever a key's hash says so, so adding or editing a few records changes
+# only the chunks around them and the rest are shared with earlier backups.
+# Other files (the issue archive) are cut into fixed-size chunks.
+
+# Datasets a backup holds; the dashboard counters are recounted after a restore
+BACKUP_DATASETS = ('users', 'books', 'issues', 'settings')
+
+# Average records per chunk (a key ends a chunk when its hash is 0 mod this)
+CHUNK_RECORDS = 256
+
+# Chunk size for files
+FILE_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Compress in worker processes once there are at least this many new chunks
+POOL_MIN_CHUNKS = 8
+POOL_WORKERS = min(4, os.cpu_count() or 1)
+
+# Workers come from a fork server (spawned where there is none), not forked
+# from the server process: a fork would copy locks its other threads hold
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Most chunks handed to the workers and not yet written, so only a few are
+# held in memory at once however large the backup
+MAX_PENDING = 2 * POOL_WORKERS
+
+
+def _records(data):
+    """(key, record) pairs of a dataset in key order: users and settings by name, books and issues by id."""
+    pairs = data.items() if isinstance(data, dict) else ((record['id'], record) for record in data)
+    return sorted(pairs, key=lambda pair: pair[0])
+
+
+def _record_chunks(data):
+    chunk = []
+    for key, record in _records(data):
+        chunk.append((key, record))
+        if zlib.crc32(repr(key).encode('utf-8')) % CHUNK_RECORDS == 0:
+            yield pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL)
+            chunk = []
+    if chunk:
+        yield pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _file_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(FILE_CHUNK_BYTES)
+            if not data:
+                break
+            yield data
+
+
+def _compress(data):
+    return zlib.compress(data, 6)
+
+
+class BackupProgress:
+    """State of a running (or the last) backup, for the page to show."""
+
+    def __init__(self):
+        self.stage = "Starting"
+        self.done = 0
+        self.total = 0
+        self.backup_id = None
+        self.error = None
+        self.finished = False
+
+    @property
+    def fraction(self):
+        if self.finished:
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+
+class BackupStore:
+    """Backups kept as compressed, deduplicated chunks plus one manifest per backup."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.chunk_dir = self.path / "chunks"
+        self.manifest_dir = self.path / "manifests"
+
+    def _chunk_path(self, digest):
+        return self.chunk_dir / digest[:2] / digest
+
+    def backups(self):
+        """Backup ids (timestamps), newest first."""
+        if not self.manifest_dir.exists():
+            return []
+        return sorted((path.stem for path in self.manifest_dir.glob('*.json')), reverse=True)
+
+    def manifest(self, backup_id):
+        with open(self.manifest_dir / f"{backup_id}.json", encoding='utf-8') as f:
+            return json.load(f)
+
+    def create(self, datasets, files=None, progress=None):
+        """Store a backup of datasets ({name: data}) and files ({name: path}).
+
+        Only chunks not already in the store are compressed and written.
+        Returns the backup id.
+        """
+        progress = progress or BackupProgress()
+        files = files or {}
+        backup_id = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        while (self.manifest_dir / f"{backup_id}.json").exists():
+            backup_id += "_1"
+
+        # Cut everything into chunks, and compress and write each one the
+        # store hasn't got as it comes: in worker processes once there are
+        # enough of them, with only a few waiting for a worker at a time
+        manifest = {'id': backup_id, 'created': datetime.now().isoformat(timespec='seconds'),
+                    'datasets': {}, 'files': {}}
+        new_chunks = set()
+        total_bytes = 0
+        stored_bytes = 0
+        pool = None
+        pending = {}                        # future -> digest of the chunk it compresses
+        sources = [('datasets', name, _record_chunks(data)) for name, data in datasets.items()]
+        sources += [('files', name, _file_chunks(path)) for name, path in files.items()]
+        try:
+            for section, name, chunks in sources:
+                progress.stage = f"Backing up {name}"
+                digests = []
+                for chunk in chunks:
+                    digest = hashlib.sha256(chunk).hexdigest()
+                    digests.append(digest)
+                    total_bytes += len(chunk)
+                    if digest in new_chunks or self._chunk_path(digest).exists():
+                        continue
+                    new_chunks.add(digest)
+                    progress.total += 1
+                    if pool is None and len(new_chunks) >= POOL_MIN_CHUNKS and POOL_WORKERS > 1:
+                        pool = ProcessPoolExecutor(max_workers=POOL_WORKERS,
+                                                   mp_context=multiprocessing.get_context(POOL_START_METHOD))
+                    if pool is None:
+                        stored_bytes += self._write_chunk(digest, _compress(chunk), progress)
+                        continue
+                    stored_bytes += self._write_completed(pending, MAX_PENDING - 1, progress)
+                    pending[pool.submit(_compress, chunk)] = digest
+                manifest[section][name] = digests
+            stored_bytes += self._write_completed(pending, 0, progress)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        progress.stage = "Writing manifest"
+        manifest.update(chunks=sum(len(digests) for section in ('datasets', 'files')
+                                   for digests in manifest[section].values()),
+                        new_chunks=len(new_chunks), bytes=total_bytes, stored_bytes=stored_bytes)
+        self.manifest_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_dir / f"{backup_id}.json.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_dir / f"{backup_id}.json")
+        return backup_id
+
+    def _write_chunk(self, digest, data, progress):
+        path = self._chunk_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write under a temporary name and rename, so a chunk is never half there
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        progress.done += 1
+        return len(data)
+
+    def _write_completed(self, pending, limit, progress):
+        # Write chunks as their compression finishes, until at most limit are pending
+        stored_bytes = 0
+        while len(pending) > limit:
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stored_bytes += self._write_chunk(pending.pop(future), future.result(), progress)
+        return stored_bytes
+
+    def _chunk(self, digest):
+        with open(self._chunk_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def read_datasets(self, backup_id):
+        """{name: data} as they were when the backup was taken."""
+        datasets = {}
+        for name, digests in self.manifest(backup_id)['datasets'].items():
+            records = [pair for digest in digests for pair in pickle.loads(self._chunk(digest))]
+            if name in ('users', 'settings'):
+                datasets[name] = dict(records)
+            else:
+                datasets[name] = [record for key, record in records]
+        return datasets
+
+    def restore_files(self, backup_id, directory):
+        """Write the backup's files under directory. Returns their names."""
+        names = []
+        for name, digests in self.manifest(backup_id)['files'].items():
+            path = Path(directory) / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + '.tmp')
+            with open(tmp, 'wb') as f:
+                for digest in digests:
+                    f.write(self._chunk(digest))
+            os.replace(tmp, path)
+            names.append(name)
+        return names
+
+
+def link_files(files, directory):
+    """Hard-link files ({name: path}) under directory, copying where linking fails.
+
+    The files are never changed in place, so the links keep their contents
+    as they are now for as long as a backup needs them. Returns {name: new path}.
+    """
+    linked = {}
+    for name, path in files.items():
+        target = Path(directory) / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+        linked[name] = target
+    return linked
+
+
+def run_backup(store, datasets, files, progress, staging=None):
+    """Take a backup on the calling thread, recording the outcome in progress.
+
+    staging, if given, is a directory of linked files removed once the backup is done.
+    """
+    try:
+        progress.backup_id = store.create(datasets, files, progress)
+        progress.stage = "Done"
+    except Exception as error:
+        progress.error = str(error)
+        progress.stage = "Failed"
+    finally:
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+        progress.finished = True
+
+
+def backup_in_background(store, datasets, files, staging=None):
+    """Take a backup on a background thread. Returns its BackupProgress."""
+    progress = BackupProgress()
+    threading.Thread(target=run_backup, args=(store, datasets, files, progress, staging),
+                     name="backup", daemon=True).start()
+    return progress
@@ -0,0 +1,128 @@
+import csv
+import json
+import sys
+from contextlib import contextmanager
+from datetime import date
+from itertools import islice
+
+# Input for bulk jobs run from the command line: a CSV file with a header
+# line, or a file of JSON objects one per line. Rows are read one at a time
+# and handled in batches, so a file of any size runs in constant memory.
+
+FORMATS = ('csv', 'jsonl')
+
+SUFFIXES = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl'}
+
+
+class RowError(ValueError):
+    """A row that can't be used as it is."""
+
+
+def file_format(path, format=None):
+    """The format to read path in: format if given, otherwise from its suffix."""
+    if format is not None:
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format '{format}' (use one of {', '.join(FORMATS)})")
+        return format
+    for suffix, name in SUFFIXES.items():
+        if str(path).lower().endswith(suffix):
+            return name
+    raise ValueError(f"Can't tell the format of {path}: name it .csv or .jsonl, or give --format")
+
+
+@contextmanager
+def _open(path):
+    if str(path) == '-':
+        yield sys.stdin
+    else:
+        # utf-8-sig: spreadsheet exports often start with a byte order mark
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            yield f
+
+
+def read_rows(path, format=None):
+    """(line number, row) for each row of path ('-' for standard input).
+
+    A row is a dict of column name to value; in CSV files empty cells are
+    left out. A line that isn't a JSON object is passed on as a RowError in
+    place of the row, so one bad line doesn't stop the rest.
+    """
+    format = file_format(path, format or ('csv' if str(path) == '-' else None))
+    with _open(path) as f:
+        if format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, {key: value.strip() for key, value in row.items()
+                                        if key is not None and value and value.strip()}
+        else:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    yield line_no, RowError(f"not valid JSON ({error.msg})")
+                    continue
+                if not isinstance(row, dict):
+                    yield line_no, RowError("not a JSON object")
+                    continue
+                yield line_no, {key: value for key, value in row.items() if value not in (None, '')}
+
+
+def batched(iterable, size):
+    """Lists of up to size items from iterable, in order."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# Field parsers for rows: CSV cells are all text, JSON values may already be
+# numbers. Each raises RowError naming the field.
+
+def text_field(row, field, required=True):
+    value = row.get(field)
+    if value is None:
+        if required:
+            raise RowError(f"{field} is required")
+        return None
+    return str(value).strip()
+
+
+def int_field(row, field, required=True):
+    value = row.get(field)
+    if value is None:
+        if required:
+            raise RowError(f"{field} is required")
+        return None
+    if isinstance(value, bool):
+        raise RowError(f"{field} must be a whole number")
+    try:
+        number = int(value) if isinstance(value, (int, str)) else None
+    except ValueError:
+        number = None
+    if number is None:
+        raise RowError(f"{field} must be a whole number")
+    return number
+
+
+def float_field(row, field, default=0.0):
+    value = row.get(field)
+    if value is None:
+        return default
+    try:
+        number = float(value) if not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        number = None
+    if number is None or number < 0:
+        raise RowError(f"{field} must be a non-negative number")
+    return number
+
+
+def date_field(row, field):
+    value = row.get(field)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise RowError(f"{field} must be a date (YYYY-MM-DD)")
@@ -0,0 +1,71 @@
+import threading
+
+
+class DatasetCache:
+    """One deserialized copy of each dataset, shared by every session.
+
+    Streamlit runs all browser sessions as threads of one server process, so
+    a module-level cache lets them all reuse the same objects. An entry is
+    dropped as soon as the engine reports a new version of its dataset,
+    whether that came from a save in this process or from another process
+    sharing the data directory. Values derived from a dataset are updated in
+    place with the records either one wrote, when they know how to be.
+    Cached data is shared: copy a record before changing it.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.RLock()
+        self._entries = {}
+        # Values derived from a dataset (indexes etc.), keyed by (name, builder)
+        self._derived = {}
+        engine.add_listener(self._changed, external=True)
+
+    def version(self, name):
+        return self.engine.version(name)
+
+    def get(self, name):
+        with self._lock:
+            version = self.engine.version(name)
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != version:
+                entry = (version, self.engine.load(name))
+                self._entries[name] = entry
+            return entry[1]
+
+    def derive(self, name, build):
+        """Return build(data) for the current version of a dataset.
+
+        The result is computed once per version and shared like the data itself.
+        A result with an apply_changes(changed, removed) method is updated in
+        place by this process's own saves instead of being built again.
+        """
+        with self._lock:
+            entry = self._derived.get((name, build))
+            if entry is None or entry[0] != self.engine.version(name):
+                data = self.get(name)
+                entry = (self._entries[name][0], build(data))
+                self._derived[(name, build)] = entry
+            return entry[1]
+
+    def _changed(self, changes, versions):
+        # Bring incrementally maintained values up to the version just written.
+        # The engine may still hold its lock here, and derive() takes the two
+        # locks the other way round, so this must not wait for self._lock.
+        for key, entry in list(self._derived.items()):
+            name = key[0]
+            version, value = entry
+            if name in changes and version == versions[name][0] and hasattr(value, 'apply_changes'):
+                value.apply_changes(*changes[name])
+                if self._derived.get(key) is entry:
+                    self._derived[key] = (versions[name][1], value)
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+                self._derived.clear()
+            else:
+                self._entries.pop(name, None)
+                for key in [key for key in self._derived if key[0] == name]:
+                    del self._derived[key]
@@ -0,0 +1,145 @@
+from datetime import date
+from operator import mul
+
+from .bulk import RowError, batched, int_field
+
+# Bulk import of books from rows of a CSV or JSON-lines file (see core/bulk.py).
+# Each row is checked and turned into a book record, ISBNs already in the
+# catalogue or earlier in the file are skipped, and the books are committed a
+# large batch at a time under ids reserved from the persistent book sequence.
+
+# Books committed together
+BATCH_SIZE = 10000
+
+# Column names accepted for each field, including MARC tags (and their $a subfields)
+FIELD_NAMES = {
+    'title': ('title', '245', '245a'),
+    'author': ('author', '100', '100a'),
+    'isbn': ('isbn', '020', '020a'),
+    'category': ('category', 'subject', '650', '650a'),
+    'stock': ('stock', 'copies'),
+}
+
+DEFAULT_CATEGORY = "Other"
+
+# Check digit weights
+ISBN10_WEIGHTS = tuple(range(10, 0, -1))
+ISBN13_WEIGHTS = (1, 3) * 6 + (1,)
+
+
+def clean_isbn(isbn):
+    """An ISBN with hyphens and spaces dropped and X in upper case."""
+    return str(isbn).replace('-', '').replace(' ', '').upper()
+
+
+def isbn_key(isbn):
+    """An ISBN as compared for duplicates: cleaned, and an ISBN-10 as its ISBN-13."""
+    isbn = clean_isbn(isbn)
+    if len(isbn) == 10 and valid_isbn(isbn):
+        body = '978' + isbn[:9]
+        check = -sum(map(mul, ISBN13_WEIGHTS, map(int, body))) % 10
+        return body + str(check)
+    return isbn
+
+
+def valid_isbn(isbn):
+    """Whether isbn (as returned by clean_isbn) is an ISBN-10 or ISBN-13 with the right check digit."""
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        digits = [int(c) for c in isbn[:9]] + [10 if isbn[9] == 'X' else int(isbn[9])]
+        return sum(map(mul, ISBN10_WEIGHTS, digits)) % 11 == 0
+    if len(isbn) == 13 and isbn.isdigit():
+        return sum(map(mul, ISBN13_WEIGHTS, map(int, isbn))) % 10 == 0
+    return False
+
+
+def _field(row, field):
+    for name in FIELD_NAMES[field]:
+        value = row.get(name)
+        if value is not None and str(value).strip():
+            return value
+    return None
+
+
+def book_from_row(row, today):
+    """The book record (without an id) a row describes; RowError if it can't be used."""
+    title = _field(row, 'title')
+    author = _field(row, 'author')
+    isbn = _field(row, 'isbn')
+    for field, value in (('title', title), ('author', author), ('isbn', isbn)):
+        if value is None:
+            raise RowError(f"{field} is required")
+    # MARC 020 may carry a qualifier after the number, e.g. "0306406152 (pbk.)"
+    isbn = clean_isbn(str(isbn).split('(')[0])
+    if not valid_isbn(isbn):
+        raise RowError(f"{isbn} is not a valid ISBN")
+    stock = _field(row, 'stock')
+    stock = 1 if stock is None else int_field({'stock': stock}, 'stock')
+    if stock < 1:
+        raise RowError("stock must be at least 1")
+    return {
+        'title': str(title).strip(),
+        'author': str(author).strip(),
+        'isbn': isbn,
+        'category': str(_field(row, 'category') or DEFAULT_CATEGORY).strip(),
+        'stock': stock,
+        'available': stock,
+        'added_on': today
+    }
+
+
+class CatalogueImport:
+    """Adds books from rows of a bulk file to the catalogue.
+
+    isbns is a hash index of every ISBN in the catalogue (as isbn_key), so
+    telling whether a row is a duplicate doesn't depend on the catalogue's
+    size. Running the same file again imports only what the last run didn't.
+    """
+
+    def __init__(self, storage, batch_size=None, today=None):
+        self.storage = storage
+        self.batch_size = batch_size or BATCH_SIZE
+        self.today = today or date.today()
+        self.isbns = {isbn_key(book['isbn']): book['id'] for book in storage.load('books')}
+        self.added = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def run(self, rows):
+        """Import (line number, row) pairs from read_rows().
+
+        Yields (line number, message) for each row left out, as it goes.
+        """
+        for chunk in batched(rows, self.batch_size):
+            books = []
+            pending = {}                    # ISBN -> line of the book in this batch
+            for line_no, row in chunk:
+                try:
+                    if isinstance(row, RowError):
+                        raise row
+                    book = book_from_row(row, self.today)
+                except RowError as error:
+                    self.failed += 1
+                    yield line_no, str(error)
+                    continue
+                key = isbn_key(book['isbn'])
+                if key in self.isbns:
+                    self.skipped += 1
+                    yield line_no, f"ISBN {book['isbn']} is already in the catalogue (book {self.isbns[key]})"
+                    continue
+                if key in pending:
+                    self.skipped += 1
+                    yield line_no, f"ISBN {book['isbn']} is a duplicate of line {pending[key]}"
+                    continue
+                pending[key] = line_no
+                books.append((key, book))
+            if books:
+                self._commit(books)
+
+    def _commit(self, books):
+        first_id = self.storage.reserve_ids('books', len(books))
+        records = []
+        for book_id, (key, book) in enumerate(books, first_id):
+            self.isbns[key] = book_id
+            records.append((book_id, {'id': book_id, **book}))
+        self.storage.apply({'books': (records, [])})
+        self.added += len(records)
@@ -0,0 +1,260 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from .overdue import days_overdue
+from .storage import ConflictError
+
+# Issue, return and renew as transactions. Each one reads the records it
+# depends on together with their version stamps, works out the change, and
+# commits the book and issue records together only if none of the records it
+# read has been written in the meantime; otherwise it reads them again and
+# retries. Desks working on different books and borrowers never wait for each
+# other, and two desks going for the last copy can't both get it.
+
+# Attempts before a transaction that keeps conflicting is given up
+MAX_ATTEMPTS = 8
+
+# Longest pause before the first retry (seconds); it doubles with every retry
+RETRY_DELAY = 0.005
+
+
+class CirculationError(Exception):
+    """The loan can't be issued, returned or renewed as asked."""
+
+
+def can_borrow(user):
+    return user['active'] and user['role'] == 'user'
+
+
+class OpenLoans:
+    """Ids of the open issues of each user and of each book, built once per version of issues.
+
+    apply_changes() keeps it current as issues are saved, so checking a
+    borrower's loan limit doesn't mean going through every issue.
+    """
+
+    def __init__(self, issues):
+        self._lock = threading.Lock()
+        self.by_user = defaultdict(set)
+        self.by_book = defaultdict(set)
+        self.loan_of = {}                   # issue id -> (username, book id)
+        for issue in issues:
+            if issue['return_date'] is None:
+                self._add(issue['id'], issue)
+
+    def _add(self, issue_id, issue):
+        self.by_user[issue['username']].add(issue_id)
+        self.by_book[issue['book_id']].add(issue_id)
+        self.loan_of[issue_id] = (issue['username'], issue['book_id'])
+
+    def _discard(self, issue_id):
+        loan = self.loan_of.pop(issue_id, None)
+        if loan is not None:
+            self.by_user[loan[0]].discard(issue_id)
+            self.by_book[loan[1]].discard(issue_id)
+
+    def apply_changes(self, changed, removed):
+        with self._lock:
+            for issue_id in removed:
+                self._discard(issue_id)
+            for issue_id, issue in changed:
+                self._discard(issue_id)
+                if issue['return_date'] is None:
+                    self._add(issue_id, issue)
+
+    def count(self, username):
+        with self._lock:
+            return len(self.by_user.get(username, ()))
+
+    def for_book(self, book_id):
+        """Ids of the open issues of a book, oldest first."""
+        with self._lock:
+            return sorted(self.by_book.get(book_id, ()))
+
+
+class _Reads:
+    """Records read by one attempt of one or more transactions, with their stamps.
+
+    Transactions run together (see Circulation.run_all) stage their changes
+    here, so each one reads the records as the ones before it left them.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.stamps = {}
+        self.records = {}                   # name -> {key: record as last read or staged}
+        self.staged = {}                    # name -> {key: record, or None once removed}
+        self.opened = defaultdict(int)      # username -> open loans added by staged changes
+
+    def get(self, name, key):
+        records = self.records.setdefault(name, {})
+        if key not in records:
+            records[key], self.stamps.setdefault(name, {})[key] = self.storage.read(name, key)
+        return records[key]
+
+    def stage(self, changes):
+        for name, (changed, removed) in changes.items():
+            records = self.records.setdefault(name, {})
+            staged = self.staged.setdefault(name, {})
+            for key, record in changed:
+                old = records.get(key)
+                if name == 'issues':
+                    was_open = old is not None and old['return_date'] is None
+                    if record['return_date'] is None and not was_open:
+                        self.opened[record['username']] += 1
+                    elif record['return_date'] is not None and was_open:
+                        self.opened[record['username']] -= 1
+                records[key] = staged[key] = record
+            for key in removed:
+                records[key] = staged[key] = None
+
+    def changes(self):
+        return {name: ([(key, record) for key, record in staged.items() if record is not None],
+                       [key for key, record in staged.items() if record is None])
+                for name, staged in self.staged.items()}
+
+
+class Circulation:
+    """Circulation transactions against a storage engine.
+
+    open_loans() returns the OpenLoans of the current issues and settings()
+    the current settings.
+    """
+
+    def __init__(self, storage, open_loans, settings):
+        self.storage = storage
+        self.open_loans = open_loans
+        self.settings = settings
+
+    def run_all(self, transactions):
+        """Run transactions (from issuing(), returning() and renewing()) and commit them together.
+
+        Returns, for each one, its result or the CirculationError that
+        stopped it; the others are committed all the same.
+        """
+        for tries in range(MAX_ATTEMPTS):
+            reads = _Reads(self.storage)
+            results = []
+            for attempt in transactions:
+                try:
+                    changes, result = attempt(reads)
+                except CirculationError as error:
+                    results.append(error)
+                    continue
+                reads.stage(changes)
+                results.append(result)
+            try:
+                changes = reads.changes()
+                if changes:
+                    self.storage.apply(changes, reads.stamps)
+                return results
+            except ConflictError:
+                # Another desk got there first: wait a moment (longer each
+                # time, so colliding desks spread out) and start over
+                time.sleep(random.uniform(0, RETRY_DELAY * 2 ** tries))
+        raise CirculationError("The records kept changing while this was being saved; please try again")
+
+    def _run(self, attempt):
+        result, = self.run_all([attempt])
+        if isinstance(result, CirculationError):
+            raise result
+        return result
+
+    def issue_book(self, username, book_id, issue_date=None):
+        """Lend a copy of a book to a user. Returns the new issue record."""
+        return self._run(self.issuing(username, book_id, issue_date))
+
+    def return_book(self, issue_id, return_date=None, fine_paid=0.0):
+        """Take a loan back. Returns the updated issue record."""
+        return self._run(self.returning(issue_id, return_date, fine_paid))
+
+    def renew(self, issue_id, today=None):
+        """Extend a loan by another loan period. Returns the updated issue record."""
+        return self._run(self.renewing(issue_id, today))
+
+    # Each of these returns a transaction: attempt(reads) -> (changes, result)
+
+    def issuing(self, username, book_id, issue_date=None):
+        issue_date = issue_date or date.today()
+        # Reserved once, from the persistent sequence every process shares:
+        # an id held by an archived loan is never handed out again, and a
+        # retry reuses the id rather than leaving a gap per attempt
+        issue_ids = [self.storage.reserve_ids('issues')]
+
+        def attempt(reads):
+            # Data from before the sequence may already hold the id: its stamp
+            # is checked like any other record's, and a taken id is replaced
+            while reads.get('issues', issue_ids[-1]) is not None:
+                issue_ids.append(self.storage.reserve_ids('issues'))
+            issue_id = issue_ids[-1]
+            # The user's stamp is taken before their loans are counted: any
+            # loan issued to them after that is a conflict, not a miscount
+            user = reads.get('users', username)
+            if user is None or not can_borrow(user):
+                raise CirculationError(f"{username} can't borrow books")
+            book = reads.get('books', book_id)
+            if book is None:
+                raise CirculationError(f"There is no book with ID {book_id}")
+            if book['available'] <= 0:
+                raise CirculationError(f"No copies of '{book['title']}' are available")
+            settings = self.settings()
+            max_books = settings['max_books_per_user']
+            if self.open_loans().count(username) + reads.opened[username] >= max_books:
+                raise CirculationError(f"{username} has already reached the maximum limit of {max_books} books")
+
+            issue = {
+                'id': issue_id,
+                'username': username,
+                'book_id': book_id,
+                'issue_date': issue_date,
+                'expected_return_date': issue_date + timedelta(days=settings['loan_period_days']),
+                'return_date': None,
+                'fine_paid': 0.0,
+                'status': 'issued'
+            }
+            changes = {
+                'books': ([(book_id, dict(book, available=book['available'] - 1))], []),
+                'issues': ([(issue_id, issue)], [])
+            }
+            return changes, issue
+
+        return attempt
+
+    def returning(self, issue_id, return_date=None, fine_paid=0.0):
+        return_date = return_date or date.today()
+
+        def attempt(reads):
+            issue = reads.get('issues', issue_id)
+            if issue is None:
+                raise CirculationError(f"There is no issue with ID {issue_id}")
+            if issue['return_date'] is not None:
+                raise CirculationError(f"Issue {issue_id} has already been returned")
+            returned = dict(issue, return_date=return_date, fine_paid=fine_paid, status='returned')
+            changes = {'issues': ([(issue_id, returned)], [])}
+            book = reads.get('books', issue['book_id'])
+            # A book deleted from the catalogue has no copies to put back
+            if book is not None:
+                changes['books'] = ([(book['id'], dict(book, available=book['available'] + 1))], [])
+            return changes, returned
+
+        return attempt
+
+    def renewing(self, issue_id, today=None):
+        today = today or date.today()
+
+        def attempt(reads):
+            issue = reads.get('issues', issue_id)
+            if issue is None:
+                raise CirculationError(f"There is no issue with ID {issue_id}")
+            if issue['return_date'] is not None:
+                raise CirculationError(f"Issue {issue_id} has already been returned")
+            if days_overdue(issue, today) > 0:
+                raise CirculationError(f"Issue {issue_id} is overdue: return it and settle the fine instead")
+            due = issue['expected_return_date'] + timedelta(days=self.settings()['loan_period_days'])
+            renewed = dict(issue, expected_return_date=due)
+            return {'issues': ([(issue_id, renewed)], [])}, renewed
+
+        return attempt
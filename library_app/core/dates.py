@@ -0,0 +1,62 @@
+from datetime import date, datetime
+
+# Dates are stored as native date / datetime values. str() of either gives the
+# same text the app used to store, so displaying a date needs no formatting.
+DATE_FIELDS = {
+    'books': ('added_on',),
+    'issues': ('issue_date', 'expected_return_date', 'return_date'),
+}
+DATETIME_FIELDS = {
+    'users': ('created_at',),
+    'audit_logs': ('timestamp',),
+}
+
+
+def now():
+    """The current time, to the second, as stored in created_at and audit timestamps."""
+    return datetime.now().replace(microsecond=0)
+
+
+def to_date(value):
+    """A stored or legacy ('%Y-%m-%d') value as a date; None stays None."""
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def to_datetime(value):
+    """A stored or legacy ('%Y-%m-%d %H:%M:%S') value as a datetime; None stays None."""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def _typed(record, date_fields, datetime_fields):
+    """A copy of record with its date fields converted, or None if none were strings."""
+    changed = {}
+    for field in date_fields:
+        if isinstance(record.get(field), str):
+            changed[field] = to_date(record[field])
+    for field in datetime_fields:
+        if isinstance(record.get(field), str):
+            changed[field] = to_datetime(record[field])
+    return dict(record, **changed) if changed else None
+
+
+def typed_records(name, data):
+    """data with string dates converted, or None if it is already typed."""
+    date_fields = DATE_FIELDS.get(name, ())
+    datetime_fields = DATETIME_FIELDS.get(name, ())
+    if isinstance(data, dict):
+        typed = {key: _typed(record, date_fields, datetime_fields) for key, record in data.items()}
+        if not any(typed.values()):
+            return None
+        return {key: typed[key] or record for key, record in data.items()}
+    typed = [_typed(record, date_fields, datetime_fields) for record in data]
+    if not any(typed):
+        return None
+    return [new or record for new, record in zip(typed, data)]
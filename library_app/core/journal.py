@@ -0,0 +1,70 @@
+import os
+import pickle
+import struct
+import time
+import zlib
+from pathlib import Path
+
+# Every record is framed as <length, crc32> followed by the pickled payload,
+# so a write torn by a crash is recognised and dropped on the next read.
+FRAME_HEADER = struct.Struct('<II')
+
+
+class Journal:
+    """Append-only file of pickled records."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        # Time of the oldest record not yet checkpointed (None when empty)
+        self.started_at = time.time() if self.size() else None
+
+    def size(self):
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def age(self):
+        if self.started_at is None:
+            return 0.0
+        return time.time() - self.started_at
+
+    def records(self):
+        """Return every complete record, cutting off a torn tail if there is one."""
+        records = []
+        if not self.path.exists():
+            return records
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        offset = 0
+        while offset + FRAME_HEADER.size <= len(data):
+            length, crc = FRAME_HEADER.unpack_from(data, offset)
+            start = offset + FRAME_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append(pickle.loads(payload))
+            offset = start + length
+
+        if offset != len(data):
+            # Drop the partial frame so later appends stay readable
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+        return records
+
+    def append(self, record):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.path, 'ab') as f:
+            f.write(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        if self.started_at is None:
+            self.started_at = time.time()
+
+    def clear(self):
+        with open(self.path, 'wb') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.started_at = None
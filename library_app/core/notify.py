@@ -0,0 +1,116 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+# Change notification between server processes sharing a data directory.
+# A ChangeWatcher calls back soon after any file in the directory is written,
+# whichever process wrote it; the callback lets the storage engine pick up
+# the new records and pass them on to the caches. On Linux it uses inotify;
+# elsewhere (or if inotify isn't available) it polls the files' sizes and
+# modification times.
+
+logger = logging.getLogger(__name__)
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# Events arriving within this long of each other are handled as one (seconds)
+SETTLE_DELAY = 0.02
+
+# How often the polling fallback looks at the files (seconds)
+POLL_INTERVAL = 1.0
+
+
+def _inotify():
+    # (libc, fd) watching nothing yet, or None where inotify isn't available
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    return libc, fd
+
+
+class ChangeWatcher:
+    """Calls callback() on a background thread whenever files in directory change."""
+
+    def __init__(self, directory, callback, poll_interval=POLL_INTERVAL):
+        self.directory = Path(directory)
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.mode = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        inotify = _inotify()
+        if inotify is not None:
+            libc, fd = inotify
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), WATCH_MASK) >= 0:
+                self.mode = "inotify"
+                self._thread = threading.Thread(target=self._watch, args=(fd,), name="change-watcher", daemon=True)
+            else:
+                os.close(fd)
+        if self._thread is None:
+            self.mode = "polling"
+            self._thread = threading.Thread(target=self._poll, name="change-watcher", daemon=True)
+        self._thread.start()
+
+    def _changed(self):
+        try:
+            self.callback()
+        except OSError:
+            # A file was being replaced; the next change (or poll) tries again
+            pass
+        except Exception:
+            # Logged, and the watcher carries on: the next change tries again
+            logger.exception("Picking up changes from other processes failed")
+
+    def _watch(self, fd):
+        while True:
+            data = os.read(fd, 64 * 1024)
+            # Let a burst of writes (a save touches several files) settle, then drain it
+            time.sleep(SETTLE_DELAY)
+            os.set_blocking(fd, False)
+            try:
+                while os.read(fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+            finally:
+                os.set_blocking(fd, True)
+            if data:
+                self._changed()
+
+    def _signature(self):
+        signature = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    signature[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return signature
+
+    def _poll(self):
+        last = self._signature()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                signature = self._signature()
+            except OSError:
+                continue
+            if signature != last:
+                last = signature
+                self._changed()
@@ -0,0 +1,74 @@
+import threading
+from bisect import bisect_left, insort
+
+# One rule for the whole app: an open issue is overdue once its expected
+# return date is before today. Dates are compared as day ordinals.
+
+
+def due_ordinal(issue):
+    return issue['expected_return_date'].toordinal()
+
+
+def days_overdue(issue, today):
+    """Days past the due date (negative while the issue is still due)."""
+    return today.toordinal() - due_ordinal(issue)
+
+
+def fine_due(issue, today, fine_per_day):
+    """Fine an issue has run up by today (nothing while it is still due)."""
+    return max(days_overdue(issue, today), 0) * fine_per_day
+
+
+def is_open(issue):
+    return issue['return_date'] is None
+
+
+def is_overdue(issue, today):
+    return issue['return_date'] is None and days_overdue(issue, today) > 0
+
+
+class DueIndex:
+    """Open issues ordered by due date, kept current as issues are saved.
+
+    Counting overdue issues is a binary search and listing them is a slice,
+    so neither depends on how many issues are still due; a save moves only
+    the issues it changed.
+    """
+
+    def __init__(self, issues):
+        self._lock = threading.Lock()
+        self.open = {issue['id']: issue for issue in issues if issue['return_date'] is None}
+        self.entries = sorted((due_ordinal(issue), issue_id) for issue_id, issue in self.open.items())
+
+    def _discard(self, issue_id):
+        issue = self.open.pop(issue_id, None)
+        if issue is not None:
+            del self.entries[bisect_left(self.entries, (due_ordinal(issue), issue_id))]
+
+    def apply_changes(self, changed, removed):
+        with self._lock:
+            for issue_id in removed:
+                self._discard(issue_id)
+            for issue_id, issue in changed:
+                self._discard(issue_id)
+                if issue['return_date'] is None:
+                    self.open[issue_id] = issue
+                    insort(self.entries, (due_ordinal(issue), issue_id))
+
+    def count_overdue(self, today):
+        with self._lock:
+            return bisect_left(self.entries, (today.toordinal(),))
+
+    def overdue(self, today, limit=None, offset=0):
+        """Overdue issues, most overdue first (from position offset, at most limit)."""
+        with self._lock:
+            end = bisect_left(self.entries, (today.toordinal(),))
+            if limit is not None:
+                end = min(end, offset + limit)
+            return [self.open[issue_id] for due, issue_id in self.entries[offset:end]]
+
+
+def count_overdue(stats, today):
+    """Overdue count from the open-issues-per-due-date counter in stats."""
+    today = today.toordinal()
+    return sum(count for due, count in stats['open_by_due_date'].items() if due < today)
@@ -0,0 +1,214 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Report engine. Issues, books and users are turned into DataFrames once per
+# version of each dataset; every report is then a few vectorized
+# filters, joins and groupbys over those frames. Dates are held as day
+# ordinals (0 = no date), so date ranges and day counts are integer maths.
+
+_EPOCH = 719163  # date(1970, 1, 1).toordinal()
+
+
+def _ordinals(values):
+    return np.fromiter((value.toordinal() if value is not None else 0 for value in values),
+                       dtype=np.int64, count=len(values))
+
+
+def _labels(values, format):
+    """Display labels for values; each distinct value is formatted only once."""
+    codes, uniques = pd.factorize(values)
+    labels = pd.Index(format(uniques), dtype=object)
+    categories = labels.unique()
+    return pd.Categorical.from_codes(categories.get_indexer(labels)[codes], categories=categories)
+
+
+def _day_text(ordinals):
+    return np.datetime_as_string((np.asarray(ordinals) - _EPOCH).astype('datetime64[D]'))
+
+
+def _date_text(ordinals, missing=''):
+    """Day ordinals as 'YYYY-MM-DD' strings (missing for 0)."""
+    return _labels(ordinals, lambda days: np.where(days > 0, _day_text(days), missing))
+
+
+def _money(amounts):
+    return _labels(amounts, lambda amounts: ['${:.2f}'.format(amount) for amount in amounts])
+
+
+def issues_frame(issues):
+    """One row per issue record."""
+    return pd.DataFrame({
+        'id': np.fromiter((issue['id'] for issue in issues), dtype=np.int64, count=len(issues)),
+        'username': pd.Categorical([issue['username'] for issue in issues]),
+        'book_id': np.fromiter((issue['book_id'] for issue in issues), dtype=np.int64, count=len(issues)),
+        'issue_day': _ordinals([issue['issue_date'] for issue in issues]),
+        'return_day': _ordinals([issue['return_date'] for issue in issues]),
+        'fine_paid': np.fromiter((issue['fine_paid'] or 0.0 for issue in issues), dtype=np.float64, count=len(issues)),
+        'status': pd.Categorical([issue['status'] for issue in issues]),
+    })
+
+
+def books_frame(books):
+    """One row per book, indexed by book id."""
+    return pd.DataFrame({
+        'title': pd.Categorical([book['title'] for book in books]),
+        'author': pd.Categorical([book['author'] for book in books]),
+        'category': pd.Categorical([book['category'] for book in books]),
+        'stock': np.fromiter((book['stock'] for book in books), dtype=np.int64, count=len(books)),
+        'available': np.fromiter((book['available'] for book in books), dtype=np.int64, count=len(books)),
+        'added_day': _ordinals([book['added_on'] for book in books]),
+    }, index=pd.Index([book['id'] for book in books], dtype=np.int64, name='book_id'))
+
+
+def users_frame(users):
+    """One row per user, indexed by username."""
+    return pd.DataFrame({
+        'name': [f"{user['first_name']} {user['last_name']}" for user in users.values()],
+        'email': [user['email'] for user in users.values()],
+    }, index=pd.Index(list(users), name='username'))
+
+
+class Reports:
+    """The library reports, computed from shared, read-only frames.
+
+    issues holds the issues still in the row store; returned issues that
+    have been archived are read from the archive as each report needs them.
+    """
+
+    def __init__(self, issues, books, users, archive):
+        self.issues = issues
+        self.books = books
+        self.users = users
+        self.archive = archive
+
+    # A record can briefly be in both places while it is being archived. Ids
+    # are never handed out twice, so it is the same loan: the row store's copy
+    # is the one used, and it counts once.
+
+    def issue_count(self):
+        archived = self.archive.read(['id']).column('id').to_numpy()
+        return len(self.issues) + int(np.count_nonzero(~np.isin(archived, self.issues['id'].to_numpy())))
+
+    def _all_issues(self, columns, start_date=None, end_date=None):
+        """Issues from the row store and the archive, as one frame with the given columns.
+
+        Only archive months between start_date and end_date are read.
+        """
+        columns = ['id'] + [column for column in columns if column != 'id']
+        archived = self.archive.read(columns, start_date, end_date).to_pandas()
+        if not len(archived):
+            return self.issues[columns]
+        archived = archived[~archived['id'].isin(self.issues['id'])]
+        frame = pd.concat([archived, self.issues[columns]], ignore_index=True)
+        for column in ('username', 'status'):
+            if column in columns:
+                frame[column] = union_categoricals([archived[column], self.issues[column]])
+        # Issue ids go up in recording order, which is the order the row store keeps
+        if not frame['id'].is_monotonic_increasing:
+            frame = frame.sort_values('id', kind='stable', ignore_index=True)
+        return frame
+
+    def _with_book(self, issues):
+        """issues joined to their book (issues of deleted books are dropped)."""
+        return issues.join(self.books[['title', 'author', 'category']], on='book_id', how='inner')
+
+    def _with_user(self, issues):
+        """issues with the user's name and email (issues of deleted users are dropped)."""
+        issues = issues.assign(name=issues['username'].map(self.users['name']),
+                               email=issues['username'].map(self.users['email']))
+        return issues[issues['name'].notna()]
+
+    def lending_history(self, start_date, end_date, username=None, book_id=None):
+        """Issues made between two dates, optionally for one user and/or book.
+
+        Returns (rows for display, summary dict).
+        """
+        issues = self._all_issues(['username', 'book_id', 'issue_day', 'return_day', 'fine_paid', 'status'],
+                                  start_date, end_date)
+        mask = issues['issue_day'].between(start_date.toordinal(), end_date.toordinal())
+        if username is not None:
+            mask &= issues['username'] == username
+        if book_id is not None:
+            mask &= issues['book_id'] == book_id
+        issues = self._with_book(issues[mask])
+        summary = {
+            'total': len(issues),
+            'returned': int((issues['return_day'] > 0).sum()),
+            'out': int((issues['return_day'] == 0).sum()),
+            'fines': float(issues['fine_paid'].sum()),
+        }
+        issues = self._with_user(issues)
+        rows = pd.DataFrame({
+            'User': _labels(issues['name'], list),
+            'Book': _labels(issues['title'], list),
+            'Issue Date': _date_text(issues['issue_day']),
+            'Return Date': _date_text(issues['return_day'], 'Not Returned'),
+            'Status': _labels(issues['status'], lambda statuses: [status.capitalize() for status in statuses]),
+            'Fine Paid': _money(issues['fine_paid']),
+        }).reset_index(drop=True)
+        return rows, summary
+
+    def inventory(self):
+        books = self.books
+        return pd.DataFrame({
+            'Title': books['title'].astype(str),
+            'Author': books['author'].astype(str),
+            'Category': books['category'].astype(str),
+            'Total Stock': books['stock'],
+            'Available': books['available'],
+            'Checked Out': books['stock'] - books['available'],
+            'Added On': _date_text(books['added_day']),
+        }).reset_index(drop=True)
+
+    def stock_by_category(self):
+        return self.books.groupby('category', observed=True, sort=False)['stock'].sum()
+
+    def popular_books(self):
+        """Books by number of times borrowed, most borrowed first."""
+        counts = self._all_issues(['book_id']).groupby('book_id', sort=False).size().rename('count')
+        books = counts.to_frame().join(self.books[['title', 'author', 'category']], how='inner')
+        books = books.sort_values('count', ascending=False, kind='stable')
+        return pd.DataFrame({
+            'Title': books['title'].astype(str),
+            'Author': books['author'].astype(str),
+            'Category': books['category'].astype(str),
+            'Times Borrowed': books['count'],
+        }).reset_index(drop=True)
+
+    def active_users(self):
+        """Users by number of books borrowed, most active first."""
+        counts = self._all_issues(['username']).groupby('username', observed=True, sort=False).size().rename('count')
+        counts.index = counts.index.astype(str)
+        users = counts.to_frame().join(self.users, how='inner')
+        users = users.sort_values('count', ascending=False, kind='stable')
+        return pd.DataFrame({
+            'Name': users['name'],
+            'Email': users['email'],
+            'Books Borrowed': users['count'],
+        }).reset_index(drop=True)
+
+    def fine_collection(self, today):
+        """Issues with a fine paid. Returns (rows for display, summary dict, fines per 'YYYY-MM')."""
+        issues = self._all_issues(['username', 'book_id', 'issue_day', 'return_day', 'fine_paid'])
+        fined = issues[issues['fine_paid'] > 0]
+        total = float(fined['fine_paid'].sum())
+        summary = {
+            'total': total,
+            'count': len(fined),
+            'average': total / len(fined) if len(fined) else 0.0,
+        }
+        returned = fined[fined['return_day'] > 0]
+        months = np.datetime_as_string((returned['return_day'].to_numpy() - _EPOCH).astype('datetime64[D]').astype('datetime64[M]'))
+        monthly = returned['fine_paid'].groupby(months).sum().sort_index()
+        issues = self._with_user(self._with_book(fined))
+        kept_until = np.where(issues['return_day'] > 0, issues['return_day'], today.toordinal())
+        rows = pd.DataFrame({
+            'User': _labels(issues['name'], list),
+            'Book': _labels(issues['title'], list),
+            'Issue Date': _date_text(issues['issue_day']),
+            'Return Date': _date_text(issues['return_day'], 'Not Returned'),
+            'Days Kept': kept_until - issues['issue_day'],
+            'Fine Amount': _money(issues['fine_paid']),
+        }).reset_index(drop=True)
+        return rows, summary, monthly
@@ -0,0 +1,181 @@
+import threading
+from collections import defaultdict
+from itertools import islice
+
+
+class BookIndex:
+    """Books by id and by ISBN, kept current as books are saved."""
+
+    def __init__(self, books):
+        self._lock = threading.Lock()
+        self.by_id = {}
+        self.ids_by_isbn = defaultdict(set)
+        for book in books:
+            self.by_id[book['id']] = book
+            self.ids_by_isbn[book['isbn']].add(book['id'])
+
+    def apply_changes(self, changed, removed):
+        with self._lock:
+            for book_id in list(removed) + [book_id for book_id, book in changed]:
+                old = self.by_id.pop(book_id, None)
+                if old is not None:
+                    self.ids_by_isbn[old['isbn']].discard(book_id)
+            for book_id, book in changed:
+                self.by_id[book_id] = book
+                self.ids_by_isbn[book['isbn']].add(book_id)
+
+    def book(self, book_id):
+        return self.by_id.get(book_id)
+
+    def book_by_isbn(self, isbn):
+        # The first book for an ISBN if the catalogue has duplicates
+        with self._lock:
+            ids = self.ids_by_isbn.get(isbn)
+            return self.by_id[min(ids)] if ids else None
+
+
+class IsbnIndex:
+    """Book ids by ISBN, kept current as books are saved."""
+
+    def __init__(self, books):
+        self._lock = threading.Lock()
+        self.ids = defaultdict(set)
+        self.isbn_of = {}
+        for book in books:
+            self.ids[book['isbn']].add(book['id'])
+            self.isbn_of[book['id']] = book['isbn']
+
+    def apply_changes(self, changed, removed):
+        with self._lock:
+            for book_id in list(removed) + [book_id for book_id, book in changed]:
+                isbn = self.isbn_of.pop(book_id, None)
+                if isbn is not None:
+                    self.ids[isbn].discard(book_id)
+            for book_id, book in changed:
+                self.ids[book['isbn']].add(book_id)
+                self.isbn_of[book_id] = book['isbn']
+
+    def book_id(self, isbn):
+        """Id of the book with an ISBN (the first one if the catalogue has duplicates), or None."""
+        with self._lock:
+            ids = self.ids.get(isbn)
+            return min(ids) if ids else None
+
+
+class IssueIndex:
+    """Issue records by id, by book and by user, kept current as issues are saved.
+
+    Open issues (not yet returned) are also indexed by book and by
+    (username, book_id), which is what the return desk looks up. Each group
+    is a dict from issue id to issue, in the order the issues were recorded.
+    """
+
+    def __init__(self, issues):
+        self._lock = threading.Lock()
+        self.by_id = {}
+        self.by_book = defaultdict(dict)
+        self.by_user = defaultdict(dict)
+        self.open = {}
+        self.open_by_book = defaultdict(dict)
+        self.open_by_loan = defaultdict(dict)
+        for issue in issues:
+            self._add(issue['id'], issue)
+
+    def _groups(self, issue):
+        groups = [self.by_book[issue['book_id']], self.by_user[issue['username']]]
+        if issue['return_date'] is None:
+            groups += [self.open, self.open_by_book[issue['book_id']],
+                       self.open_by_loan[(issue['username'], issue['book_id'])]]
+        return groups
+
+    def _add(self, issue_id, issue):
+        self.by_id[issue_id] = issue
+        for group in self._groups(issue):
+            # An issue already in a group is replaced where it stands
+            group[issue_id] = issue
+
+    def _discard(self, issue_id, keep=()):
+        issue = self.by_id.pop(issue_id, None)
+        if issue is not None:
+            for group in self._groups(issue):
+                if not any(group is kept for kept in keep):
+                    group.pop(issue_id, None)
+
+    def apply_changes(self, changed, removed):
+        with self._lock:
+            for issue_id in removed:
+                self._discard(issue_id)
+            for issue_id, issue in changed:
+                # Leave the issue in the groups it stays in, so they keep their order
+                self._discard(issue_id, keep=self._groups(issue))
+                self._add(issue_id, issue)
+
+    def issue(self, issue_id):
+        return self.by_id.get(issue_id)
+
+    def issues_in(self, group, key):
+        with self._lock:
+            return list(group.get(key, {}).values())
+
+    def open_issues(self, limit=None):
+        with self._lock:
+            return list(islice(self.open.values(), limit))
+
+    def count_open(self):
+        return len(self.open)
+
+
+class Repository:
+    """Indexed, read-only view of the current library data."""
+
+    def __init__(self, users, books, issues, due):
+        self.users = users
+        self.book_index = books
+        self.issue_index = issues
+        self.due_index = due
+
+    def book(self, book_id):
+        return self.book_index.book(book_id)
+
+    def book_by_isbn(self, isbn):
+        return self.book_index.book_by_isbn(isbn)
+
+    def user(self, username):
+        return self.users.get(username)
+
+    def issue(self, issue_id):
+        return self.issue_index.issue(issue_id)
+
+    def open_issues(self, limit=None):
+        """Open issues in the order they were recorded (the first limit of them)."""
+        return self.issue_index.open_issues(limit)
+
+    def count_open(self):
+        return self.issue_index.count_open()
+
+    def open_issues_for(self, username, book_id):
+        return self.issue_index.issues_in(self.issue_index.open_by_loan, (username, book_id))
+
+    def scan_open_issues(self, code):
+        """Open issues matching a scanned issue id or book ISBN."""
+        code = code.strip()
+        if code.isdigit():
+            issue = self.issue(int(code))
+            if issue is not None and issue['return_date'] is None:
+                return [issue]
+        book = self.book_by_isbn(code)
+        if book is not None:
+            return self.issue_index.issues_in(self.issue_index.open_by_book, book['id'])
+        return []
+
+    def count_overdue(self, today):
+        return self.due_index.count_overdue(today)
+
+    def overdue_issues(self, today, limit=None, offset=0):
+        return self.due_index.overdue(today, limit, offset)
+
+    def issues_for_book(self, book_id):
+        return self.issue_index.issues_in(self.issue_index.by_book, book_id)
+
+    def issues_for_user(self, username):
+        return self.issue_index.issues_in(self.issue_index.by_user, username)
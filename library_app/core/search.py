@@ -0,0 +1,249 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+import numpy as np
+
+# Ranked book search. An inverted index maps each term of a book's title,
+# author, ISBN and category to the books containing it. Query terms match
+# exactly, as a prefix of longer terms, or (when neither finds anything)
+# through shared trigrams, so small typos still find the book. Results are
+# ranked with BM25 over the field-weighted term counts.
+
+FIELD_WEIGHTS = {'title': 3.0, 'author': 2.0, 'isbn': 2.0, 'category': 1.0}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# How much a prefix or trigram (typo) match counts compared to an exact one
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+MAX_EXPANSIONS = 50
+MIN_SIMILARITY = 0.3
+
+_TOKEN = re.compile(r'[0-9a-z]+')
+
+
+def tokenize(text):
+    return _TOKEN.findall(str(text).lower())
+
+
+def trigrams(term):
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _term_counts(book):
+    # Weighted count of each term over the indexed fields
+    counts = defaultdict(float)
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(book.get(field, '')):
+            counts[term] += weight
+    return counts
+
+
+def _fuzzy(term):
+    # Typo matching is for words; numbers (ISBNs) only match exactly or by prefix
+    return not term.isdigit()
+
+
+class BookSearchIndex:
+    """Inverted index over the book catalogue, built once per version of books.
+
+    apply_changes() keeps it current when books are added, edited or deleted,
+    so a save doesn't mean indexing the whole catalogue again. Each book has
+    a slot number; postings map slots to weighted term counts and are turned
+    into arrays on first use, so scoring a common term is one vectorized step.
+    """
+
+    def __init__(self, books):
+        self._lock = threading.Lock()
+        self.postings = defaultdict(dict)   # term -> {slot: weighted term count}
+        self.slot_of = {}                   # book id -> slot
+        self.book_ids = []                  # slot -> book id (None once removed)
+        self.doc_terms = []                 # slot -> {term: weighted term count}
+        self.doc_lengths = np.zeros(max(len(books), 1))
+        self.total_length = 0.0
+        self.by_trigram = defaultdict(set)  # trigram -> terms containing it
+        self._arrays = {}                   # term -> (slots, counts), built on demand
+        self._norms = None                  # BM25 length normalisation per slot
+        for book in books:
+            self._add(book['id'], book)
+        # Sorted once here; later terms are inserted in place
+        self.vocabulary = sorted(self.postings)
+        for term in self.vocabulary:
+            if _fuzzy(term):
+                for gram in trigrams(term):
+                    self.by_trigram[gram].add(term)
+
+    def _add(self, book_id, book, new_terms=None):
+        counts = _term_counts(book)
+        slot = self.slot_of.get(book_id)
+        if slot is None:
+            slot = len(self.book_ids)
+            self.slot_of[book_id] = slot
+            self.book_ids.append(book_id)
+            self.doc_terms.append(counts)
+            if slot >= len(self.doc_lengths):
+                self.doc_lengths = np.concatenate([self.doc_lengths, np.zeros(len(self.doc_lengths))])
+        elif counts == self.doc_terms[slot]:
+            # Only fields the index doesn't cover (stock, availability) changed
+            return
+        else:
+            self._clear(slot)
+            self.doc_terms[slot] = counts
+        self.doc_lengths[slot] = sum(counts.values())
+        self.total_length += self.doc_lengths[slot]
+        self._norms = None
+
+        for term, count in counts.items():
+            if new_terms is not None and term not in self.postings:
+                new_terms.append(term)
+            self.postings[term][slot] = count
+            self._arrays.pop(term, None)
+
+    def _clear(self, slot):
+        # Take the slot's terms out of the postings, keeping the slot itself
+        for term in self.doc_terms[slot]:
+            posting = self.postings[term]
+            del posting[slot]
+            self._arrays.pop(term, None)
+            if not posting:
+                del self.postings[term]
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+                for gram in trigrams(term):
+                    self.by_trigram[gram].discard(term)
+        self.total_length -= self.doc_lengths[slot]
+        self.doc_lengths[slot] = 0.0
+        self.doc_terms[slot] = {}
+        self._norms = None
+
+    def _remove(self, book_id):
+        slot = self.slot_of.pop(book_id, None)
+        if slot is None:
+            return
+        self._clear(slot)
+        self.book_ids[slot] = None
+
+    def apply_changes(self, changed, removed):
+        """Update the index with changed (book id, book) pairs and removed book ids.
+
+        An edited book keeps its slot, and one whose indexed fields are
+        unchanged (a loan or return only moves its availability) is left alone.
+        """
+        with self._lock:
+            new_terms = []
+            for book_id in removed:
+                self._remove(book_id)
+            for book_id, book in changed:
+                self._add(book_id, book, new_terms)
+            for term in new_terms:
+                position = bisect_left(self.vocabulary, term)
+                in_vocabulary = position < len(self.vocabulary) and self.vocabulary[position] == term
+                if term in self.postings and not in_vocabulary:
+                    self.vocabulary.insert(position, term)
+                    if _fuzzy(term):
+                        for gram in trigrams(term):
+                            self.by_trigram[gram].add(term)
+
+    def _posting_arrays(self, term):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            posting = self.postings[term]
+            arrays = (np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                      np.fromiter(posting.values(), dtype=np.float64, count=len(posting)))
+            self._arrays[term] = arrays
+        return arrays
+
+    def _expand(self, term):
+        # Index terms a query term matches, with how much each match counts
+        matches = {}
+        if term in self.postings:
+            matches[term] = 1.0
+        position = bisect_left(self.vocabulary, term)
+        while len(matches) < MAX_EXPANSIONS and position < len(self.vocabulary):
+            candidate = self.vocabulary[position]
+            if not candidate.startswith(term):
+                break
+            matches.setdefault(candidate, PREFIX_WEIGHT)
+            position += 1
+        if matches or len(term) < 3 or not _fuzzy(term):
+            return matches
+
+        grams = trigrams(term)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self.by_trigram.get(gram, ()):
+                shared[candidate] += 1
+        similar = []
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + len(trigrams(candidate)) - count)
+            if similarity >= MIN_SIMILARITY:
+                similar.append((similarity, candidate))
+        for similarity, candidate in heapq.nlargest(MAX_EXPANSIONS, similar):
+            matches[candidate] = FUZZY_WEIGHT * similarity
+        return matches
+
+    def search(self, query, limit=None):
+        """Ids of the books matching query, best first.
+
+        Books matching more of the query's terms come first, then higher BM25 scores.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            book_count = len(self.slot_of)
+            if not terms or not book_count:
+                return []
+            slot_count = len(self.book_ids)
+            if self._norms is None:
+                self._norms = K1 * (1 - B + B * self.doc_lengths[:slot_count] / (self.total_length / book_count))
+            norms = self._norms
+            scores = np.zeros(slot_count)
+            matched = np.zeros(slot_count)
+            for term in terms:
+                best = np.zeros(slot_count)
+                for index_term, weight in self._expand(term).items():
+                    slots, counts = self._posting_arrays(index_term)
+                    idf = np.log(1 + (book_count - len(slots) + 0.5) / (len(slots) + 0.5))
+                    term_scores = weight * idf * counts * (K1 + 1) / (counts + norms[slots])
+                    best[slots] = np.maximum(best[slots], term_scores)
+                scores += best
+                matched += best > 0
+
+            # Matched term count first, BM25 score as the tie-break (scaled below 1)
+            candidates = np.flatnonzero(matched)
+            rank = matched[candidates] + scores[candidates] / (scores.max() + 1)
+            if limit is not None and limit < len(candidates):
+                top = np.argpartition(-rank, limit)[:limit]
+                candidates, rank = candidates[top], rank[top]
+            order = candidates[np.argsort(-rank, kind='stable')]
+            return [self.book_ids[slot] for slot in order]
+
+
+class UserSearchIndex:
+    """Prefix index over usernames, names and email addresses, built once per version of users."""
+
+    def __init__(self, users):
+        self.usernames = sorted(users)
+        entries = sorted({(term, username) for username, user in users.items()
+                          for term in [username.lower()] + tokenize(username) + tokenize(user['first_name'])
+                          + tokenize(user['last_name']) + tokenize(user['email'])})
+        self.terms = [term for term, username in entries]
+        self.owners = [username for term, username in entries]
+
+    def _with_prefix(self, prefix):
+        start = bisect_left(self.terms, prefix)
+        end = bisect_right(self.terms, prefix + '\uffff', lo=start)
+        return set(self.owners[start:end])
+
+    def search(self, query):
+        """Usernames matching every word of query as a prefix; an exact username first."""
+        terms = tokenize(query)
+        if not terms:
+            return self.usernames
+        matches = set.intersection(*(self._with_prefix(term) for term in terms))
+        exact = query.strip().lower()
+        return sorted(matches, key=lambda username: (username.lower() != exact, username))
@@ -0,0 +1,84 @@
+from collections import Counter
+
+from .overdue import due_ordinal
+
+# The dashboard counters live in the 'stats' dataset:
+#   total_books        number of book records
+#   active_users       number of users with active set
+#   books_on_loan      sum of stock - available over all books
+#   open_by_due_date   {due date ordinal: number of open issues due that day}
+COUNTER_KEYS = ('total_books', 'active_users', 'books_on_loan')
+STATS_KEYS = COUNTER_KEYS + ('open_by_due_date',)
+
+
+def _contribution(name, record):
+    # What a single record adds to the counters
+    if name == 'books':
+        return Counter({'total_books': 1, 'books_on_loan': record['stock'] - record['available']})
+    if name == 'users':
+        return Counter({'active_users': 1 if record['active'] else 0})
+    if name == 'issues' and record['return_date'] is None:
+        return Counter({('open_by_due_date', due_ordinal(record)): 1})
+    return Counter()
+
+
+def _add(stats, delta):
+    # Entries of stats that change when a Counter of contributions is added
+    updated = {}
+    for key, amount in delta.items():
+        if not amount:
+            continue
+        if isinstance(key, tuple):
+            histogram = updated.setdefault(key[0], dict(stats[key[0]]))
+            histogram[key[1]] = histogram.get(key[1], 0) + amount
+            if not histogram[key[1]]:
+                del histogram[key[1]]
+        else:
+            updated[key] = stats[key] + amount
+    return updated
+
+
+def compute_stats(users, books, issues):
+    """Recompute every counter from scratch (the admin repair action)."""
+    total = Counter()
+    for name, records in (('users', users.values()), ('books', books), ('issues', issues)):
+        for record in records:
+            total.update(_contribution(name, record))
+    stats = dict.fromkeys(COUNTER_KEYS, 0)
+    stats['open_by_due_date'] = {}
+    stats.update(_add(stats, total))
+    return stats
+
+
+class StatsHook:
+    """Storage hook that keeps the 'stats' dataset in step with every write.
+
+    It works out how each changed book, user and issue record moves the
+    counters and adds the new counter values to the same change, so they are
+    committed together with the records themselves.
+    """
+
+    def __call__(self, engine, changes):
+        stats = engine._rows_for('stats')
+        if not stats or 'stats' in changes:
+            # Not built yet, or being replaced wholesale by rebuild_stats()
+            return changes
+
+        delta = Counter()
+        for name in ('books', 'users', 'issues'):
+            if name not in changes:
+                continue
+            rows = engine._rows_for(name)
+            changed, removed = changes[name]
+            for key in removed:
+                if key in rows:
+                    delta.subtract(_contribution(name, rows[key]))
+            for key, record in changed:
+                if key in rows:
+                    delta.subtract(_contribution(name, rows[key]))
+                delta.update(_contribution(name, record))
+
+        updated = _add(stats, delta)
+        if updated:
+            changes = dict(changes, stats=(list(updated.items()), []))
+        return changes
@@ -0,0 +1,873 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from .journal import Journal
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows: there a data directory serves a single process
+    fcntl = None
+
+# Names of the datasets every engine stores
+DATASETS = ('users', 'books', 'issues', 'settings', 'stats', 'sequences')
+
+# Datasets that are a plain {key: value} dict rather than a collection of
+# records. 'sequences' holds the last id reserved by reserve_ids() per dataset.
+KEY_VALUE_DATASETS = ('settings', 'stats', 'sequences')
+
+
+class ConflictError(Exception):
+    """A record changed after it was read, so a change based on it was not written."""
+
+
+class StorageEngine:
+    """Interface shared by all storage backends.
+
+    users and settings are dicts, books and issues are lists of dicts,
+    exactly as the pages have always used them.
+
+    Hooks registered with add_hook() see every change before it is written
+    and may add changes of their own, which are committed in the same write.
+    Listeners registered with add_listener() are told about every change
+    once it has been committed.
+
+    Every record has a version stamp (see read()) that moves on whenever the
+    record is written, so a change computed from records read earlier can be
+    committed only if none of them has changed since (apply(expect=...)).
+    """
+
+    def add_hook(self, hook):
+        """Register hook(engine, changes) -> changes, run on every apply()."""
+        self._hooks.append(hook)
+
+    def _run_hooks(self, changes):
+        for hook in self._hooks:
+            changes = hook(self, changes)
+        return changes
+
+    def add_listener(self, listener, external=False):
+        """Register listener(changes, versions), called after every apply().
+
+        versions maps each changed dataset to its (old, new) version. It may
+        run while the engine lock is held, so it must not wait on locks of its
+        own that are held by code calling into the engine.
+
+        With external=True the listener is also told about changes other
+        processes committed, as soon as this engine picks them up.
+        """
+        self._listeners.append((listener, external))
+
+    def _notify(self, changes, versions, external=False):
+        for listener, wants_external in self._listeners:
+            if wants_external or not external:
+                listener(changes, versions)
+
+    def _picked_up(self, name, changed, removed, old_version):
+        # Records another process wrote were merged into the rows: move their
+        # stamps on and pass the change to the listeners that want it
+        self._applied(name, changed)
+        self._stamp_records({name: (changed, removed)}, {})
+        self._notify({name: (changed, removed)}, {name: (old_version, self._generations[name])}, external=True)
+
+    def refresh(self):
+        """Pick up whatever other processes have committed since the last look."""
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def load(self, name):
+        """Return the dataset. The result is shared and must not be modified."""
+        raise NotImplementedError
+
+    def version(self, name):
+        """Return a number that changes whenever the dataset changes."""
+        raise NotImplementedError
+
+    def save(self, name, data):
+        self.save_many({name: data})
+
+    def save_many(self, datasets):
+        """Save several datasets ({name: data}) as one all-or-nothing change."""
+        with self._lock:
+            changes = {}
+            for name, data in datasets.items():
+                changed, removed = _diff(name, self._rows_for(name), data)
+                if changed or removed:
+                    changes[name] = (changed, removed)
+            if changes:
+                self.apply(changes)
+
+    def apply(self, changes, expect=None):
+        """Write record-level changes as one all-or-nothing change.
+
+        changes maps a dataset name to (changed, removed), where changed is a
+        list of (key, record) pairs and removed a list of keys. Books and
+        issues are keyed by 'id', users by username, settings and stats by
+        entry name.
+
+        expect, if given, maps dataset names to {key: stamp} as returned by
+        read(). If any of those records has been written since, nothing is
+        written and ConflictError is raised. The records in expect count as
+        written by this change, so two changes that both checked the same
+        record can't both go through.
+        """
+        raise NotImplementedError
+
+    def read(self, name, key):
+        """(record, version stamp) of one record; the record is None if there is none."""
+        with self._lock:
+            record = self._rows_for(name).get(key)
+            return record, self._stamp_of(name, key)
+
+    def _stamp_of(self, name, key):
+        return max(self._loaded_at.get(name, 0), self._record_stamps.get(name, {}).get(key, 0))
+
+    def _reloaded(self, name):
+        # The rows were read afresh, maybe with changes made by another
+        # process that can't be told apart: every stamp moves on
+        self._clock += 1
+        self._loaded_at[name] = self._clock
+        self._record_stamps[name] = {}
+
+    def _check_stamps(self, expect):
+        for name, stamps in expect.items():
+            self._rows_for(name)
+            for key, stamp in stamps.items():
+                if self._stamp_of(name, key) != stamp:
+                    raise ConflictError(f"{name} record {key!r} changed since it was read")
+
+    def _stamp_records(self, changes, expect):
+        self._clock += 1
+        for name, (changed, removed) in changes.items():
+            record_stamps = self._record_stamps.setdefault(name, {})
+            for key, record in changed:
+                record_stamps[key] = self._clock
+            for key in removed:
+                record_stamps[key] = self._clock
+        for name, stamps in expect.items():
+            record_stamps = self._record_stamps.setdefault(name, {})
+            for key in stamps:
+                record_stamps[key] = self._clock
+
+    def _first_unused_id(self, name):
+        if name not in self._next_ids:
+            self._next_ids[name] = max(max(self._rows_for(name), default=0), self._id_floors.get(name, 0)) + 1
+        return self._next_ids[name]
+
+    def next_id(self, name):
+        """Reserve and return the next unused id for books or issues."""
+        with self._lock:
+            next_id = self._first_unused_id(name)
+            self._next_ids[name] += 1
+            return next_id
+
+    def reserve_ids(self, name, count=1):
+        """Reserve count consecutive ids for new records; returns the first.
+
+        Unlike next_id(), the reservation is committed to the 'sequences'
+        dataset, so an id is never handed out twice: not by another process,
+        not after a restart, and not after the record holding it is deleted.
+        """
+        while True:
+            with self._lock:
+                last, stamp = self.read('sequences', name)
+                first = max((last or 0) + 1, self._first_unused_id(name))
+                try:
+                    self.apply({'sequences': ([(name, first + count - 1)], [])}, {'sequences': {name: stamp}})
+                except ConflictError:
+                    # Another process reserved a block in the meantime
+                    continue
+                self._next_ids[name] = max(self._next_ids.get(name, 0), first + count)
+                return first
+
+    def skip_ids(self, name, last_id):
+        """Never hand out ids up to last_id, e.g. ones held by archived records.
+
+        Like a reservation, the floor is committed to the 'sequences'
+        dataset, so reserve_ids() respects it in every process.
+        """
+        while True:
+            with self._lock:
+                self._id_floors[name] = max(self._id_floors.get(name, 0), last_id)
+                if name in self._next_ids:
+                    self._next_ids[name] = max(self._next_ids[name], last_id + 1)
+                last, stamp = self.read('sequences', name)
+                if (last or 0) >= last_id:
+                    return
+                try:
+                    self.apply({'sequences': ([(name, last_id)], [])}, {'sequences': {name: stamp}})
+                except ConflictError:
+                    # Another process reserved a block in the meantime
+                    continue
+                return
+
+    @contextmanager
+    def quiesce(self):
+        """Hold off every write through this engine until the block ends."""
+        with self._lock:
+            yield self
+
+    @contextmanager
+    def exclusive(self):
+        """Hold off writes like quiesce(), and run the block in one process at a time.
+
+        For jobs every server process runs (such as archival) that must not
+        overlap when several processes share the data directory.
+        """
+        with self.quiesce():
+            yield self
+
+    def snapshot(self, names):
+        """{name: data} of several datasets as of one moment, with no write in between."""
+        with self.quiesce():
+            return {name: _materialize(name, self._rows_for(name)) for name in names}
+
+    def _rows_for(self, name):
+        # Current contents of a dataset as {key: record}
+        raise NotImplementedError
+
+    def _applied(self, name, changed):
+        # Keep reserved ids ahead of any id just written
+        if name in self._next_ids and changed:
+            self._next_ids[name] = max(self._next_ids[name], max(key for key, record in changed) + 1)
+
+    def checkpoint(self):
+        """Flush any pending log into the main data files."""
+
+    def close(self):
+        pass
+
+
+def _keyed(name, data):
+    # Turn a dataset into (key, record) pairs in display order
+    if name == 'users' or name in KEY_VALUE_DATASETS:
+        return list(data.items())
+    if name == 'books':
+        return [(book['id'], book) for book in data]
+    # Issue records saved before issue ids existed fall back to their list
+    # position; upgraded() numbers them position + 1 to match
+    return [(issue.get('id', position), issue) for position, issue in enumerate(data)]
+
+
+def _materialize(name, rows):
+    # Inverse of _keyed: build the dataset back from {key: record}
+    if name == 'users' or name in KEY_VALUE_DATASETS:
+        return dict(rows)
+    if name == 'issues':
+        return [record for key, record in sorted(rows.items())]
+    return list(rows.values())
+
+
+def _diff(name, rows, data):
+    # Records added or changed, and keys removed, going from rows to data
+    new_rows = dict(_keyed(name, data))
+    # Unchanged records are usually the very objects we handed out, so the
+    # identity check skips almost everything without comparing fields
+    changed = [(key, record) for key, record in new_rows.items()
+               if rows.get(key) is not record and (key not in rows or rows[key] != record)]
+    removed = [key for key in rows if key not in new_rows]
+    return changed, removed
+
+
+def _own(changes):
+    # Copy incoming records, so later edits to the caller's dicts can't leak in
+    return {name: (changed if name in KEY_VALUE_DATASETS else [(key, dict(record)) for key, record in changed], removed)
+            for name, (changed, removed) in changes.items()}
+
+
+def _apply(rows, changed, removed):
+    for key in removed:
+        rows.pop(key, None)
+    rows.update(changed)
+
+
+def _read_pickle(path):
+    # A data file holds the dataset, optionally followed by a second pickle
+    # with the id of the last journal transaction folded into it
+    with open(path, 'rb') as f:
+        data = pickle.load(f)
+        try:
+            meta = pickle.load(f)
+        except EOFError:
+            meta = {}
+    return data, meta.get('txn', 0)
+
+
+def _write_pickle(path, data, txn):
+    # Write to a temp file first so a crash never leaves a half-written dataset
+    tmp_path = path.with_suffix('.pkl.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(data, f)
+        pickle.dump({'txn': txn}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class PickleEngine(StorageEngine):
+    """One pickle file per dataset plus a write-ahead journal per dataset.
+
+    A save appends only the changed records to <name>.journal. A background
+    thread folds a journal back into <name>.pkl once it grows past
+    max_journal_bytes or gets older than max_journal_age seconds, and loads
+    replay whatever tail has not been folded in yet.
+    """
+
+    def __init__(self, data_dir, max_journal_bytes=4 * 1024 * 1024, max_journal_age=300.0):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.max_journal_bytes = max_journal_bytes
+        self.max_journal_age = max_journal_age
+        self._lock = threading.RLock()
+
+        self._journals = {name: Journal(self.data_dir / f"{name}.journal") for name in DATASETS}
+        # Current contents per dataset ({key: record}), with the file stamp
+        # they were read at so changes made by another process are noticed
+        self._rows = {}
+        self._stamps = {}
+        self._generations = dict.fromkeys(DATASETS, 0)
+        self._next_ids = {}
+        self._id_floors = {}
+        self._hooks = []
+        self._listeners = []
+        self._clock = 0
+        self._loaded_at = {}
+        self._record_stamps = {}
+        self._txn = 0
+        # Last journal transaction reflected in the rows of each dataset
+        self._seen = {}
+        self._lock_file = None
+        self._lock_depth = 0
+        self._checkpointer = None
+        self._wake = threading.Event()
+
+        self._recover()
+
+    def path(self, name):
+        return self.data_dir / f"{name}.pkl"
+
+    def _watermark(self, name):
+        if not self.path(name).exists():
+            return 0
+        return _read_pickle(self.path(name))[1]
+
+    @contextmanager
+    def _exclusive(self):
+        # Held (inside self._lock) while writing, and while reading journals
+        # another process may be appending to, so that several processes can
+        # share the data directory
+        if fcntl is None:
+            yield
+            return
+        if self._lock_depth == 0:
+            if self._lock_file is None:
+                self._lock_file = open(self.data_dir / "write.lock", 'ab')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def quiesce(self):
+        # Hold the write lock too, so no other process commits between the
+        # datasets read by snapshot() (or while a restore is swapped in)
+        with self._lock, self._exclusive():
+            yield self
+
+    def _recover(self):
+        # A multi-dataset save writes the same transaction to every journal
+        # involved. If we crashed half-way, copy it to the journals that
+        # missed it so each dataset sees the whole transaction.
+        with self._lock, self._exclusive():
+            seen = {name: {txn: changes for txn, changes in self._journals[name].records()}
+                    for name in DATASETS}
+            watermarks = {name: self._watermark(name) for name in DATASETS}
+            self._txn = max([0] + list(watermarks.values()) + [txn for txns in seen.values() for txn in txns])
+
+            for txns in seen.values():
+                for txn, changes in txns.items():
+                    for name in changes:
+                        if txn > watermarks[name] and txn not in seen[name]:
+                            self._journals[name].append((txn, changes))
+                            seen[name][txn] = changes
+
+    def _stamp(self, name):
+        try:
+            stat = self.path(name).stat()
+            return (stat.st_mtime_ns, stat.st_size, self._journals[name].size())
+        except FileNotFoundError:
+            return (None, None, self._journals[name].size())
+
+    def _current(self, name):
+        stamp = self._stamp(name)
+        if name in self._rows and self._stamps.get(name) == stamp:
+            return self._rows[name]
+
+        with self._exclusive():
+            stamp = self._stamp(name)
+            old = self._stamps.get(name)
+            if name in self._rows and old[:2] == stamp[:2] and old[2] <= stamp[2]:
+                # Only the journal grew: another process saved, so apply just its transactions
+                self._catch_up(name)
+                return self._rows[name]
+
+            if self.path(name).exists():
+                data, watermark = _read_pickle(self.path(name))
+                rows = dict(_keyed(name, data))
+            else:
+                rows, watermark = {}, 0
+
+            seen = watermark
+            for txn, changes in sorted(self._journals[name].records(), key=lambda record: record[0]):
+                self._txn = max(self._txn, txn)
+                if txn > watermark and name in changes:
+                    _apply(rows, *changes[name])
+                    seen = max(seen, txn)
+
+            self._rows[name] = rows
+            self._seen[name] = seen
+            self._stamps[name] = self._stamp(name)
+            self._generations[name] += 1
+            self._reloaded(name)
+            self._next_ids.pop(name, None)
+            return rows
+
+    def _catch_up(self, name):
+        changed, removed = {}, set()
+        for txn, changes in sorted(self._journals[name].records(), key=lambda record: record[0]):
+            self._txn = max(self._txn, txn)
+            if txn > self._seen[name] and name in changes:
+                self._seen[name] = txn
+                for key in changes[name][1]:
+                    changed.pop(key, None)
+                    removed.add(key)
+                for key, record in changes[name][0]:
+                    removed.discard(key)
+                    changed[key] = record
+        self._stamps[name] = self._stamp(name)
+        if changed or removed:
+            changed, removed = list(changed.items()), list(removed)
+            _apply(self._rows[name], changed, removed)
+            old_version = self._generations[name]
+            self._generations[name] += 1
+            self._picked_up(name, changed, removed, old_version)
+
+    def _rows_for(self, name):
+        return self._current(name)
+
+    def exists(self, name):
+        with self._lock:
+            return self.path(name).exists() or bool(self._current(name))
+
+    def version(self, name):
+        with self._lock:
+            self._current(name)
+            return self._generations[name]
+
+    def load(self, name):
+        with self._lock:
+            return _materialize(name, self._current(name))
+
+    def refresh(self):
+        with self._lock:
+            for name in list(self._rows):
+                self._current(name)
+
+    def save_many(self, datasets):
+        with self._lock, self._exclusive():
+            datasets = dict(datasets)
+            for name in list(datasets):
+                if not self.path(name).exists():
+                    # First save of a dataset writes the file directly
+                    _write_pickle(self.path(name), datasets.pop(name), self._txn)
+                    self._rows.pop(name, None)
+            super().save_many(datasets)
+
+    def apply(self, changes, expect=None):
+        changes = _own(changes)
+        expect = expect or {}
+        with self._lock, self._exclusive():
+            # Catch up with other processes first, so the stamps checked and
+            # the rows the hooks read are the latest
+            for name in set(changes) | set(expect):
+                self._current(name)
+            self._check_stamps(expect)
+            changes = self._run_hooks(changes)
+            for name in changes:
+                self._current(name)
+            versions = {name: self._generations[name] for name in changes}
+
+            self._txn = max(time.time_ns(), self._txn + 1)
+            for name in changes:
+                self._journals[name].append((self._txn, changes))
+            for name, (changed, removed) in changes.items():
+                _apply(self._rows[name], changed, removed)
+                self._seen[name] = self._txn
+                self._stamps[name] = self._stamp(name)
+                self._generations[name] += 1
+                self._applied(name, changed)
+                versions[name] = (versions[name], self._generations[name])
+            self._stamp_records(changes, expect)
+
+            self._start_checkpointer()
+            if any(self._journals[name].size() > self.max_journal_bytes for name in changes):
+                self._wake.set()
+        self._notify(changes, versions)
+
+    def checkpoint(self, force=True):
+        with self._lock, self._exclusive():
+            for name in DATASETS:
+                journal = self._journals[name]
+                if not journal.size():
+                    continue
+                if not force and journal.size() <= self.max_journal_bytes and journal.age() <= self.max_journal_age:
+                    continue
+                rows = self._current(name)
+                _write_pickle(self.path(name), _materialize(name, rows), self._txn)
+                journal.clear()
+                self._stamps[name] = self._stamp(name)
+
+    def _start_checkpointer(self):
+        if self._checkpointer is None:
+            self._checkpointer = threading.Thread(target=self._checkpoint_loop, name="journal-checkpoint", daemon=True)
+            self._checkpointer.start()
+
+    def _checkpoint_loop(self):
+        interval = min(self.max_journal_age, 30.0)
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.checkpoint(force=False)
+            except OSError:
+                # Try again on the next round; the journal still has everything
+                pass
+
+
+# Changes to more records than this are logged as a change to the whole dataset
+MAX_LOGGED_KEYS = 1000
+
+# How many changelog entries to keep; a process that falls further behind
+# than that reloads everything
+CHANGELOG_KEEP = 10000
+
+
+# Table layout for the SQLite backend. Every table keeps the full record
+# pickled in `record`; the other columns exist so they can be indexed.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    role TEXT,
+    active INTEGER,
+    record BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    isbn TEXT,
+    title TEXT,
+    category TEXT,
+    record BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS issues (
+    seq INTEGER PRIMARY KEY, -- the issue id
+    username TEXT,
+    book_id INTEGER,
+    returned INTEGER,
+    record BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+CREATE TABLE IF NOT EXISTS stats (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+CREATE TABLE IF NOT EXISTS sequences (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+-- Which records each commit wrote, so other processes can refresh just those
+CREATE TABLE IF NOT EXISTS changelog (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    key -- NULL when the whole dataset was rewritten
+);
+CREATE INDEX IF NOT EXISTS idx_users_role ON users (role, active);
+CREATE INDEX IF NOT EXISTS idx_books_isbn ON books (isbn);
+CREATE INDEX IF NOT EXISTS idx_books_title ON books (title);
+CREATE INDEX IF NOT EXISTS idx_books_category ON books (category);
+CREATE INDEX IF NOT EXISTS idx_issues_username ON issues (username, returned);
+CREATE INDEX IF NOT EXISTS idx_issues_book_id ON issues (book_id, returned);
+"""
+
+
+# How each dataset maps onto its table: (key column, extra indexed columns)
+SQLITE_TABLES = {
+    'users': ('username', ('role', 'active')),
+    'books': ('id', ('isbn', 'title', 'category')),
+    'issues': ('seq', ('username', 'book_id', 'returned')),
+}
+
+
+def _row_values(name, key, record):
+    # Values for the indexed columns of a record
+    if name == 'users':
+        return (key, record.get('role'), int(bool(record.get('active'))))
+    if name == 'books':
+        return (key, record.get('isbn'), record.get('title'), record.get('category'))
+    return (key, record.get('username'), record.get('book_id'), int(record.get('return_date') is not None))
+
+
+class SQLiteEngine(StorageEngine):
+    """All datasets in one SQLite database (WAL mode).
+
+    save() compares the new data with the last state read from the database
+    and only writes the rows that were added, changed or removed.
+    """
+
+    def __init__(self, db_path, import_from=None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+
+        # Last known database contents per dataset: {key: record}
+        self._snapshots = {}
+        self._generations = dict.fromkeys(DATASETS, 0)
+        self._next_ids = {}
+        self._id_floors = {}
+        self._hooks = []
+        self._listeners = []
+        self._clock = 0
+        self._loaded_at = {}
+        self._record_stamps = {}
+        self._data_version = None
+        self._lock_file = None
+        self._lock_depth = 0
+        # Last changelog entry reflected in the snapshots
+        self._last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changelog").fetchone()[0]
+
+        if import_from is not None:
+            self._import_pickles(import_from)
+
+    def _import_pickles(self, pickle_engine):
+        # First start on SQLite: copy over whatever the pickle files hold
+        for name in DATASETS:
+            if not self.exists(name) and pickle_engine.exists(name):
+                self.save(name, pickle_engine.load(name))
+
+    def _check_data_version(self):
+        # Another connection (e.g. another server process) committed: refresh
+        # the records it wrote, as told by the changelog
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        entries = self._conn.execute("SELECT seq, name, key FROM changelog WHERE seq > ? ORDER BY seq",
+                                     (self._last_seq,)).fetchall()
+        if not entries:
+            return
+        if entries[0][0] > self._last_seq + 1:
+            # Too far behind: the entries in between have been pruned
+            self._snapshots.clear()
+            self._next_ids.clear()
+            self._last_seq = entries[-1][0]
+            return
+        self._last_seq = entries[-1][0]
+        keys = {}
+        for seq, name, key in entries:
+            keys.setdefault(name, set()).add(key)
+        for name, changed_keys in keys.items():
+            if name not in self._snapshots:
+                continue
+            if None in changed_keys:
+                self._snapshots.pop(name)
+                self._next_ids.pop(name, None)
+            else:
+                self._reread(name, changed_keys)
+
+    def _reread(self, name, keys):
+        if name in KEY_VALUE_DATASETS:
+            key_column, column = 'key', 'value'
+        else:
+            key_column, column = SQLITE_TABLES[name][0], 'record'
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            for key, blob in self._conn.execute(
+                    f"SELECT {key_column}, {column} FROM {name} WHERE {key_column} IN ({placeholders})", chunk):
+                found[key] = pickle.loads(blob)
+        changed = list(found.items())
+        removed = [key for key in keys if key not in found]
+        _apply(self._snapshots[name], changed, removed)
+        old_version = self._generations[name]
+        self._generations[name] += 1
+        self._picked_up(name, changed, removed, old_version)
+
+    def _snapshot(self, name):
+        self._check_data_version()
+        if name not in self._snapshots:
+            if name in KEY_VALUE_DATASETS:
+                rows = self._conn.execute(f"SELECT key, value FROM {name} ORDER BY rowid")
+            else:
+                key_column = SQLITE_TABLES[name][0]
+                rows = self._conn.execute(f"SELECT {key_column}, record FROM {name} ORDER BY rowid")
+            self._snapshots[name] = {key: pickle.loads(blob) for key, blob in rows}
+            self._generations[name] += 1
+            self._reloaded(name)
+        return self._snapshots[name]
+
+    def _rows_for(self, name):
+        return self._snapshot(name)
+
+    def exists(self, name):
+        with self._lock:
+            return bool(self._snapshot(name))
+
+    def version(self, name):
+        with self._lock:
+            self._snapshot(name)
+            return self._generations[name]
+
+    def load(self, name):
+        with self._lock:
+            return _materialize(name, self._snapshot(name))
+
+    @contextmanager
+    def exclusive(self):
+        # SQLite serializes writes itself; write.lock only keeps these blocks
+        # from running in two processes at once
+        with self.quiesce():
+            if fcntl is None:
+                yield self
+                return
+            if self._lock_depth == 0:
+                if self._lock_file is None:
+                    self._lock_file = open(self.db_path.parent / "write.lock", 'ab')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield self
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def snapshot(self, names):
+        with self._lock:
+            # Read every dataset in one transaction, so a commit by another
+            # process lands wholly before or after the snapshot
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("SELECT 1 FROM stats LIMIT 1").fetchall()
+                return super().snapshot(names)
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _write(self, name, changed, removed):
+        if name in KEY_VALUE_DATASETS:
+            self._conn.executemany(
+                f"INSERT INTO {name} (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                [(key, pickle.dumps(value)) for key, value in changed]
+            )
+            self._conn.executemany(f"DELETE FROM {name} WHERE key = ?", [(key,) for key in removed])
+            return
+
+        key_column, columns = SQLITE_TABLES[name]
+        all_columns = (key_column,) + columns + ('record',)
+        placeholders = ", ".join("?" for _ in all_columns)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in all_columns[1:])
+        self._conn.executemany(
+            f"INSERT INTO {name} ({', '.join(all_columns)}) VALUES ({placeholders}) "
+            f"ON CONFLICT ({key_column}) DO UPDATE SET {updates}",
+            [_row_values(name, key, record) + (pickle.dumps(record),) for key, record in changed]
+        )
+        self._conn.executemany(f"DELETE FROM {name} WHERE {key_column} = ?", [(key,) for key in removed])
+
+    def _log(self, changes):
+        entries = []
+        for name, (changed, removed) in changes.items():
+            if len(changed) + len(removed) > MAX_LOGGED_KEYS:
+                entries.append((name, None))
+            else:
+                entries += [(name, key) for key, record in changed] + [(name, key) for key in removed]
+        self._conn.executemany("INSERT INTO changelog (name, key) VALUES (?, ?)", entries)
+        seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changelog").fetchone()[0]
+        self._conn.execute("DELETE FROM changelog WHERE seq <= ?", (seq - CHANGELOG_KEEP,))
+        return seq
+
+    def refresh(self):
+        with self._lock:
+            self._check_data_version()
+
+    def apply(self, changes, expect=None):
+        changes = _own(changes)
+        expect = expect or {}
+        with self._lock:
+            # Take the write lock first, so the rows checked and read by the
+            # hooks are the latest, whatever other processes have committed
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._check_data_version()
+                self._check_stamps(expect)
+                changes = self._run_hooks(changes)
+                for name in changes:
+                    self._snapshot(name)
+                versions = {name: self._generations[name] for name in changes}
+                for name, (changed, removed) in changes.items():
+                    self._write(name, changed, removed)
+                last_seq = self._log(changes)
+                self._conn.execute("COMMIT")
+            except ConflictError:
+                self._conn.execute("ROLLBACK")
+                raise
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._snapshots.clear()
+                raise
+
+            # Our own commit doesn't bump data_version, so the snapshots stay valid
+            self._last_seq = last_seq
+            for name, (changed, removed) in changes.items():
+                _apply(self._snapshots[name], changed, removed)
+                self._generations[name] += 1
+                self._applied(name, changed)
+                versions[name] = (versions[name], self._generations[name])
+            self._stamp_records(changes, expect)
+        self._notify(changes, versions)
+
+    def checkpoint(self):
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_engine(data_dir, backend=None):
+    """Open the storage engine selected by `backend` or $LIBRARY_STORAGE."""
+    backend = (backend or os.environ.get('LIBRARY_STORAGE', 'pickle')).lower()
+    pickle_engine = PickleEngine(data_dir)
+    if backend == 'pickle':
+        return pickle_engine
+    if backend == 'sqlite':
+        return SQLiteEngine(Path(data_dir) / "library.db", import_from=pickle_engine)
+    raise ValueError(f"Unknown storage backend: {backend}")
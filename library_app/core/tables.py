@@ -0,0 +1,110 @@
+import threading
+from bisect import bisect_left, insort
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Sorted, paged access to table rows. A SortedView keeps the ids of a
+# dataset's records in the order of one field; it is built once per version
+# of the dataset and updated in place by saves, so showing any page of a
+# sorted table is a slice of the view, whatever the size of the dataset.
+
+
+def _items(data):
+    """(id, record) pairs of a dataset: users are keyed by username, the rest have an 'id'."""
+    if isinstance(data, dict):
+        return data.items()
+    return ((record['id'], record) for record in data)
+
+
+def _sort_key(value):
+    # Missing values sort last; text sorts without regard to case
+    if value is None:
+        return (True, 0)
+    if isinstance(value, str):
+        return (False, value.lower())
+    return (False, value)
+
+
+class SortedView:
+    """Ids of the records of a dataset in order of one field (None = the id), ties by id.
+
+    where, if given, keeps only the records it returns true for.
+    """
+
+    def __init__(self, data, field=None, where=None):
+        self.field = field
+        self.where = where
+        self._lock = threading.Lock()
+        self._key_of = {}
+        for record_id, record in _items(data):
+            if where is None or where(record):
+                self._key_of[record_id] = self._key(record_id, record)
+        self.entries = sorted((key, record_id) for record_id, key in self._key_of.items())
+
+    def _key(self, record_id, record):
+        return _sort_key(record_id if self.field is None else record.get(self.field))
+
+    def _discard(self, record_id):
+        key = self._key_of.pop(record_id, None)
+        if key is not None:
+            del self.entries[bisect_left(self.entries, (key, record_id))]
+
+    def apply_changes(self, changed, removed):
+        with self._lock:
+            for record_id in removed:
+                self._discard(record_id)
+            for record_id, record in changed:
+                self._discard(record_id)
+                if self.where is None or self.where(record):
+                    key = self._key(record_id, record)
+                    self._key_of[record_id] = key
+                    insort(self.entries, (key, record_id))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def page(self, offset, limit, descending=False):
+        """Ids of the records at positions offset to offset + limit."""
+        with self._lock:
+            if not descending:
+                return [record_id for key, record_id in self.entries[offset:offset + limit]]
+            end = max(len(self.entries) - offset, 0)
+            start = max(end - limit, 0)
+            return [record_id for key, record_id in reversed(self.entries[start:end])]
+
+    def sort(self, record_ids, descending=False):
+        """record_ids (all in the view) in the view's order."""
+        key_of = self._key_of
+        with self._lock:
+            return sorted(record_ids, key=lambda record_id: (key_of[record_id], record_id), reverse=descending)
+
+
+@lru_cache(maxsize=None)
+def sorted_view(field=None, where=None):
+    """Builder of a SortedView, the same object for the same arguments, so the
+    dataset cache can keep one view per field."""
+    def build(data):
+        return SortedView(data, field, where)
+    return build
+
+
+def _sort_codes(column):
+    """Integer codes that sort like the values of a column (text alphabetically)."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = column.cat.categories
+        ranks = np.empty(len(categories), dtype=np.int64)
+        ranks[np.argsort(categories.to_numpy())] = np.arange(len(categories))
+        return ranks[column.cat.codes.to_numpy()]
+    return pd.factorize(column, sort=True)[0]
+
+
+def frame_page(frame, offset, limit, sort=None, descending=False):
+    """Rows offset to offset + limit of a DataFrame sorted by column sort."""
+    if sort is None:
+        rows = frame.iloc[::-1] if descending else frame
+        return rows.iloc[offset:offset + limit]
+    codes = _sort_codes(frame[sort])
+    order = np.argsort(-codes if descending else codes, kind='stable')
+    return frame.iloc[order[offset:offset + limit]]
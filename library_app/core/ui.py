@@ -0,0 +1,173 @@
+import pandas as pd
+import streamlit as st
+
+from .auth import logout
+from .data import load_settings, load_users
+from .tables import frame_page
+
+# Custom CSS for styling
+CUSTOM_CSS = """
+<style>
+    .main {
+        background-color: #f8f9fa;
+    }
+    .sidebar .sidebar-content {
+        background-color: #343a40;
+    }
+    h1, h2, h3 {
+        color: #2C3E50;
+    }
+    .stButton button {
+        background-color: #4CAF50;
+        color: white;
+        font-weight: bold;
+        border-radius: 5px;
+        border: none;
+    }
+    .stButton button:hover {
+        background-color: #45a049;
+    }
+    .login-container {
+        max-width: 500px;
+        margin: 0 auto;
+        padding: 2rem;
+        border-radius: 10px;
+        background-color: white;
+        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+    }
+    .dashboard-card {
+        padding: 1.5rem;
+        border-radius: 10px;
+        background-color: white;
+        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+        margin-bottom: 1rem;
+    }
+    .dashboard-card h3 {
+        margin-top: 0;
+    }
+    .dashboard-number {
+        font-size: 2.5rem;
+        font-weight: bold;
+        color: #2980b9;
+    }
+</style>
+"""
+
+def apply_styles():
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
+# Sidebar navigation
+def sidebar_nav():
+    settings = load_settings()
+    st.sidebar.title(f"📚 {settings['library_name']}")
+    
+    if st.session_state['logged_in']:
+        users = load_users()
+        user = users[st.session_state['username']]
+        st.sidebar.write(f"Welcome, {user['first_name']} {user['last_name']}")
+        st.sidebar.write(f"Role: {user['role'].capitalize()}")
+        
+        st.sidebar.markdown("---")
+        
+        st.sidebar.header("Navigation")
+        st.sidebar.page_link("library_app/app.py", label="📊 Dashboard", icon="🏠")
+        
+        if st.session_state['role'] == 'admin':
+            st.sidebar.page_link("library_app/pages/1_books.py", label="📖 Book Management", icon="📖")
+            st.sidebar.page_link("library_app/pages/2_users.py", label="👥 User Management", icon="👥")
+            st.sidebar.page_link("library_app/pages/3_issues.py", label="📘 Issue/Return", icon="📘")
+            st.sidebar.page_link("library_app/pages/4_reports.py", label="📊 Reports & Analytics", icon="📊")
+            st.sidebar.page_link("library_app/pages/5_settings.py", label="⚙️ Settings", icon="⚙️")
+            st.sidebar.page_link("library_app/pages/6_audit.py", label="📝 Audit Logs", icon="📝")
+        
+        st.sidebar.markdown("---")
+        if st.sidebar.button("Logout"):
+            logout()
+            st.rerun()
+
+# Number of matches a typeahead selector offers at a time
+TYPEAHEAD_LIMIT = 20
+
+# Search box plus a short list of the best matches, keyed by ID. search(query,
+# limit) runs on the server, so only the top matches are sent to the browser;
+# describe(id) gives the text shown for a match. With all_label, a first
+# option (None) stands for "no filter". Returns the selected ID or None.
+def typeahead(label, search, describe, key, all_label=None, limit=TYPEAHEAD_LIMIT):
+    query = st.text_input(label, key=f"{key}_query", placeholder="Type to search")
+    options = ([None] if all_label else []) + search(query, limit)
+    
+    if not options:
+        st.caption("No matches")
+        return None
+    
+    return st.selectbox(
+        f"{label} matches",
+        options,
+        key=key,
+        label_visibility="collapsed",
+        format_func=lambda value: all_label if value is None else describe(value)
+    )
+
+# Labels for typeahead matches; ids and ISBNs tell apart records with the same name
+def book_label(book):
+    return f"{book['title']} - {book['author']} (ISBN {book['isbn']})"
+
+def user_label(username, user):
+    return f"{user['first_name']} {user['last_name']} ({username})"
+
+# Rows per page offered by paged tables
+PAGE_SIZES = [25, 50, 100, 250]
+
+# A table shown one page at a time. fetch(offset, limit, sort, descending)
+# returns (total row count, rows of that page) and does the sorting and
+# filtering on the server, so only the rows on screen are built and sent to
+# the browser. sort_options maps the labels offered under "Sort by" to the
+# sort value passed to fetch. Returns the total row count; with no rows,
+# shows empty instead of a table.
+def paged_table(key, fetch, sort_options=None, empty="No rows to show"):
+    sort_options = sort_options or {}
+    sort_label = st.session_state.get(f"{key}_sort")
+    if sort_label not in sort_options:
+        sort_label = next(iter(sort_options), None)
+    descending = st.session_state.get(f"{key}_descending", False)
+    page_size = st.session_state.get(f"{key}_size", PAGE_SIZES[0])
+    page = st.session_state.get(f"{key}_page", 1)
+    
+    sort = sort_options.get(sort_label)
+    total, rows = fetch((page - 1) * page_size, page_size, sort, descending)
+    if not total:
+        st.info(empty)
+        return 0
+    
+    # Back to the last page when the table has shrunk below the one asked for
+    pages = (total + page_size - 1) // page_size
+    if page > pages:
+        page = pages
+        total, rows = fetch((page - 1) * page_size, page_size, sort, descending)
+    st.session_state[f"{key}_page"] = page
+    
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    
+    first = (page - 1) * page_size + 1
+    st.caption(f"Rows {first}-{min(first + page_size - 1, total)} of {total}")
+    col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
+    with col1:
+        if sort_options:
+            st.selectbox("Sort by", list(sort_options), key=f"{key}_sort")
+    with col2:
+        if sort_options:
+            st.checkbox("Descending", key=f"{key}_descending")
+    with col3:
+        st.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_size")
+    with col4:
+        st.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    return total
+
+# Paged table over a DataFrame already computed on the server (a report, say).
+# sortable lists the columns offered under "Sort by" besides the frame's own order.
+def frame_table(key, frame, sortable=(), empty="No rows to show"):
+    def fetch(offset, limit, sort, descending):
+        return len(frame), frame_page(frame, offset, limit, sort, descending)
+    
+    sort_options = dict({"Default": None}, **{column: column for column in sortable})
+    return paged_table(key, fetch, sort_options, empty)
@@ -10,12 +10,13 @@ import os
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 sys.path.append(parent_dir)
 
-# Import from app.py
-from app import (
-    load_books, save_books, 
-    load_users, save_users,
-    sidebar_nav
+# Import the shared data layer and page helpers
+from core import (
+    load_books, save_books, add_book,
+    read_record, get_book_search, search_books, page_ids
 )
+from core.auth import require_admin
+from core.ui import apply_styles, sidebar_nav, typeahead, book_label, paged_table
 
 # Set page configuration
 st.set_page_config(
@@ -25,17 +26,11 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Redirect if not logged in
-if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
-    st.warning("Please login to access this page")
-    st.switch_page("app.py")
+# Redirect unless logged in as admin
+require_admin()
 
-# Check if admin
-if st.session_state['role'] != 'admin':
-    st.error("You don't have permission to access this page")
-    st.switch_page("app.py")
-
-# Show sidebar navigation
+# Custom CSS and sidebar navigation
+apply_styles()
 sidebar_nav()
 
 # Main content
@@ -50,32 +45,34 @@ with tab1:
     books = load_books()
     
     # Search and filter
-    search = st.text_input("Search books by title, author, or ISBN")
+    search = st.text_input("Search books by title, author, ISBN or category")
     
-    # Filter books based on search
-    if search:
-        filtered_books = [book for book in books if 
-                          search.lower() in book['title'].lower() or 
-                          search.lower() in book['author'].lower() or 
-                          search.lower() in book['isbn'].lower()]
-    else:
-        filtered_books = books
+    # Ranked matches from the search index, best first
+    matches = get_book_search().search(search) if search else None
     
-    # Convert to DataFrame for display
-    if filtered_books:
-        df = pd.DataFrame(filtered_books)
-        st.dataframe(df, use_container_width=True)
-    else:
-        st.info("No books found")
+    sort_options = {"ID": None, "Title": 'title', "Author": 'author', "Category": 'category',
+                    "Available": 'available', "Added On": 'added_on'}
+    if matches is not None:
+        sort_options = dict({"Relevance": "relevance"}, **sort_options)
+    
+    # Only the page on screen is looked up and sent to the browser
+    def fetch_books(offset, limit, sort, descending):
+        if sort == "relevance":
+            page = matches[::-1] if descending else matches
+            total, book_ids = len(matches), page[offset:offset + limit]
+        else:
+            total, book_ids = page_ids('books', offset, limit, sort, descending, matches=matches)
+        return total, [read_record('books', book_id) for book_id in book_ids]
+    
+    paged_table("book_list", fetch_books, sort_options, empty="No books found")
     
     # Delete book functionality
     st.subheader("Delete Book")
     if books:
-        book_ids = {book['title']: book['id'] for book in books}
-        selected_book = st.selectbox("Select Book to Delete", list(book_ids.keys()))
+        book_id = typeahead("Select Book to Delete", search_books, lambda book_id: book_label(read_record('books', book_id)), key="delete_book")
         
-        if st.button("Delete Book"):
-            book_id = book_ids[selected_book]
+        if book_id is not None and st.button("Delete Book"):
+            selected_book = read_record('books', book_id)['title']
             books = [book for book in books if book['id'] != book_id]
             save_books(books)
             st.success(f"Book '{selected_book}' deleted successfully")
@@ -99,25 +96,18 @@ with tab2:
     
     if st.button("Add Book"):
         if title and author and isbn:
-            books = load_books()
-            
-            # Generate new ID
-            new_id = max([book['id'] for book in books], default=0) + 1
-            
-            # Create new book
+            # Create new book (its id comes from the book sequence)
             new_book = {
-                'id': new_id,
                 'title': title,
                 'author': author,
                 'isbn': isbn,
                 'category': category,
                 'stock': stock,
                 'available': stock,
-                'added_on': datetime.now().strftime('%Y-%m-%d')
+                'added_on': datetime.now().date()
             }
             
-            books.append(new_book)
-            save_books(books)
+            add_book(new_book)
             
             st.success(f"Book '{title}' added successfully")
             st.rerun()
@@ -131,39 +121,39 @@ with tab3:
     books = load_books()
     
     if books:
-        book_titles = {book['title']: book['id'] for book in books}
-        selected_title = st.selectbox("Select Book to Edit", list(book_titles.keys()))
-        selected_id = book_titles[selected_title]
+        selected_id = typeahead("Select Book to Edit", search_books, lambda book_id: book_label(read_record('books', book_id)), key="edit_book")
         
         # Get selected book
-        selected_book = next((book for book in books if book['id'] == selected_id), None)
+        selected_book = read_record('books', selected_id)
         
         if selected_book:
-            title = st.text_input("Title", value=selected_book['title'])
-            author = st.text_input("Author", value=selected_book['author'])
-            isbn = st.text_input("ISBN", value=selected_book['isbn'])
+            # Widget keys include the book id, so the fields refill when another book is picked
+            title = st.text_input("Title", value=selected_book['title'], key=f"edit_title_{selected_id}")
+            author = st.text_input("Author", value=selected_book['author'], key=f"edit_author_{selected_id}")
+            isbn = st.text_input("ISBN", value=selected_book['isbn'], key=f"edit_isbn_{selected_id}")
             
             col1, col2 = st.columns(2)
             with col1:
-                category = st.selectbox("Category", ["Fiction", "Non-fiction", "Science", "History", "Biography", "Children", "Other"], index=["Fiction", "Non-fiction", "Science", "History", "Biography", "Children", "Other"].index(selected_book['category']) if selected_book['category'] in ["Fiction", "Non-fiction", "Science", "History", "Biography", "Children", "Other"] else 0)
+                category = st.selectbox("Category", ["Fiction", "Non-fiction", "Science", "History", "Biography", "Children", "Other"], index=["Fiction", "Non-fiction", "Science", "History", "Biography", "Children", "Other"].index(selected_book['category']) if selected_book['category'] in ["Fiction", "Non-fiction", "Science", "History", "Biography", "Children", "Other"] else 0, key=f"edit_category_{selected_id}")
             with col2:
-                stock = st.number_input("Stock", min_value=1, value=selected_book['stock'])
+                stock = st.number_input("Stock", min_value=1, value=selected_book['stock'], key=f"edit_stock_{selected_id}")
             
             if st.button("Update Book"):
                 if title and author and isbn:
                     # Calculate books currently on loan
                     books_on_loan = selected_book['stock'] - selected_book['available']
                     
-                    # Update book
-                    selected_book['title'] = title
-                    selected_book['author'] = author
-                    selected_book['isbn'] = isbn
-                    selected_book['category'] = category
-                    selected_book['stock'] = stock
-                    selected_book['available'] = max(0, stock - books_on_loan)
+                    # Update a copy of the book (loaded data is shared)
+                    updated_book = dict(selected_book)
+                    updated_book['title'] = title
+                    updated_book['author'] = author
+                    updated_book['isbn'] = isbn
+                    updated_book['category'] = category
+                    updated_book['stock'] = stock
+                    updated_book['available'] = max(0, stock - books_on_loan)
                     
                     # Save books
-                    save_books(books)
+                    save_books([updated_book if book['id'] == selected_id else book for book in books])
                     
                     st.success(f"Book '{title}' updated successfully")
                     st.rerun()
@@ -200,9 +190,8 @@ with tab4:
         if st.button("Update Category"):
             if new_category:
                 # Update books
-                for book in books:
-                    if book['category'] == old_category:
-                        book['category'] = new_category
+                books = [dict(book, category=new_category) if book['category'] == old_category else book
+                         for book in books]
                 
                 # Save books
                 save_books(books)
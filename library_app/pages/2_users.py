@@ -10,11 +10,12 @@ import os
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 sys.path.append(parent_dir)
 
-# Import from app.py
-from app import (
-    load_users, save_users,
-    sidebar_nav
+# Import the shared data layer and page helpers
+from core import (
+    load_users, save_users, search_users, page_ids
 )
+from core.auth import require_admin
+from core.ui import apply_styles, sidebar_nav, typeahead, user_label, paged_table
 
 # Set page configuration
 st.set_page_config(
@@ -24,17 +25,11 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Redirect if not logged in
-if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
-    st.warning("Please login to access this page")
-    st.switch_page("app.py")
+# Redirect unless logged in as admin
+require_admin()
 
-# Check if admin
-if st.session_state['role'] != 'admin':
-    st.error("You don't have permission to access this page")
-    st.switch_page("app.py")
-
-# Show sidebar navigation
+# Custom CSS and sidebar navigation
+apply_styles()
 sidebar_nav()
 
 # Main content
@@ -51,55 +46,53 @@ with tab1:
     # Search and filter
     search = st.text_input("Search users by name or email")
     
-    # Filter users based on search
-    if search:
-        filtered_users = {k: v for k, v in users.items() if 
-                          search.lower() in v['first_name'].lower() or 
-                          search.lower() in v['last_name'].lower() or 
-                          search.lower() in v['email'].lower()}
-    else:
-        filtered_users = users
+    # Users matching the search, from the user index
+    matches = search_users(search) if search else None
     
-    # Convert to DataFrame for display
-    if filtered_users:
-        # Create list of dictionaries for DataFrame
-        users_list = []
-        for username, user in filtered_users.items():
-            user_dict = {
+    # Only the page on screen is built and sent to the browser
+    def fetch_users(offset, limit, sort, descending):
+        total, usernames = page_ids('users', offset, limit, sort, descending, matches=matches)
+        rows = []
+        for username in usernames:
+            user = users.get(username)
+            if user is None:
+                continue
+            rows.append({
                 'Username': username,
                 'Name': f"{user['first_name']} {user['last_name']}",
                 'Email': user['email'],
                 'Role': user['role'].capitalize(),
                 'Status': 'Active' if user['active'] else 'Inactive',
                 'Created': user['created_at']
-            }
-            users_list.append(user_dict)
-        
-        df = pd.DataFrame(users_list)
-        st.dataframe(df, use_container_width=True)
-    else:
-        st.info("No users found")
+            })
+        return total, rows
+    
+    sort_options = {"Username": None, "First Name": 'first_name', "Last Name": 'last_name',
+                    "Email": 'email', "Role": 'role', "Created": 'created_at'}
+    paged_table("user_list", fetch_users, sort_options, empty="No users found")
     
     # Activate/Deactivate user functionality
     st.subheader("Activate/Deactivate User")
     if users:
-        username_list = list(users.keys())
-        selected_user = st.selectbox("Select User", username_list)
-        
+        selected_user = typeahead("Select User", search_users, lambda username: user_label(username, users[username]), key="status_user")
+    
+    if users and selected_user is not None:
         is_active = users[selected_user]['active']
         if is_active:
             if st.button("Deactivate User"):
-                users[selected_user]['active'] = False
+                users = dict(users)
+                users[selected_user] = dict(users[selected_user], active=False)
                 save_users(users)
                 st.success(f"User '{selected_user}' deactivated successfully")
                 st.rerun()
         else:
             if st.button("Activate User"):
-                users[selected_user]['active'] = True
+                users = dict(users)
+                users[selected_user] = dict(users[selected_user], active=True)
                 save_users(users)
                 st.success(f"User '{selected_user}' activated successfully")
                 st.rerun()
-    else:
+    elif not users:
         st.info("No users to manage")
 
 # Add User Tab
@@ -133,9 +126,10 @@ with tab2:
                     'email': email,
                     'role': role,
                     'active': True,
-                    'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    'created_at': datetime.now().replace(microsecond=0)
                 }
                 
+                users = dict(users)
                 users[username] = new_user
                 save_users(users)
                 
@@ -151,28 +145,30 @@ with tab3:
     users = load_users()
     
     if users:
-        username_list = list(users.keys())
-        selected_user = st.selectbox("Select User to Edit", username_list)
-        
+        selected_user = typeahead("Select User to Edit", search_users, lambda username: user_label(username, users[username]), key="edit_user")
+    
+    if users and selected_user is not None:
         # Get selected user
         user = users[selected_user]
         
-        change_password = st.checkbox("Change Password")
+        # Widget keys include the username, so the fields refill when another user is picked
+        change_password = st.checkbox("Change Password", key=f"edit_change_password_{selected_user}")
         if change_password:
-            password = st.text_input("New Password", type="password")
+            password = st.text_input("New Password", type="password", key=f"edit_password_{selected_user}")
         
         col1, col2 = st.columns(2)
         with col1:
-            first_name = st.text_input("First Name", value=user['first_name'])
+            first_name = st.text_input("First Name", value=user['first_name'], key=f"edit_first_name_{selected_user}")
         with col2:
-            last_name = st.text_input("Last Name", value=user['last_name'])
+            last_name = st.text_input("Last Name", value=user['last_name'], key=f"edit_last_name_{selected_user}")
         
-        email = st.text_input("Email", value=user['email'])
-        role = st.selectbox("Role", ["admin", "user"], index=0 if user['role'] == 'admin' else 1)
+        email = st.text_input("Email", value=user['email'], key=f"edit_email_{selected_user}")
+        role = st.selectbox("Role", ["admin", "user"], index=0 if user['role'] == 'admin' else 1, key=f"edit_role_{selected_user}")
         
         if st.button("Update User"):
             if first_name and last_name and email:
-                # Update user
+                # Update a copy of the user (loaded data is shared)
+                user = dict(user)
                 user['first_name'] = first_name
                 user['last_name'] = last_name
                 user['email'] = email
@@ -182,11 +178,13 @@ with tab3:
                     user['password'] = password
                 
                 # Save users
+                users = dict(users)
+                users[selected_user] = user
                 save_users(users)
                 
                 st.success(f"User '{selected_user}' updated successfully")
                 st.rerun()
             else:
                 st.error("Please fill in all required fields")
-    else:
+    elif not users:
         st.info("No users to edit")
\ No newline at end of file
@@ -10,14 +10,16 @@ import os
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 sys.path.append(parent_dir)
 
-# Import from app.py
-from app import (
-    load_books, save_books,
-    load_users, save_users,
-    load_issues, save_issues,
-    load_settings, save_settings,
-    sidebar_nav
+# Import the shared data layer and page helpers
+from core import (
+    load_settings,
+    issue_book, return_book, renew_issue, CirculationError,
+    read_record, get_repository, search_books, search_users, search_open_issues, page_ids
 )
+from core.auth import require_admin
+from core.circulation import can_borrow
+from core.overdue import days_overdue, is_open
+from core.ui import apply_styles, sidebar_nav, typeahead, book_label, user_label, paged_table
 
 # Set page configuration
 st.set_page_config(
@@ -27,17 +29,11 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Redirect if not logged in
-if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
-    st.warning("Please login to access this page")
-    st.switch_page("app.py")
+# Redirect unless logged in as admin
+require_admin()
 
-# Check if admin
-if st.session_state['role'] != 'admin':
-    st.error("You don't have permission to access this page")
-    st.switch_page("app.py")
-
-# Show sidebar navigation
+# Custom CSS and sidebar navigation
+apply_styles()
 sidebar_nav()
 
 # Main content
@@ -51,22 +47,25 @@ with tab1:
     st.header("Issue Book to User")
     
     # Load data
-    books = load_books()
-    users = load_users()
-    issues = load_issues()
+    repo = get_repository()
+    users = repo.users
     settings = load_settings()
     
-    # Filter available books and active users
-    available_books = [book for book in books if book['available'] > 0]
-    active_users = {k: v for k, v in users.items() if v['active'] and v['role'] == 'user'}
+    # Users and books are searched on the server rather than listed in full
+    def is_available(book):
+        return book['available'] > 0
+    
+    has_books = bool(search_books('', 1, where=is_available))
+    has_users = bool(search_users('', 1, where=can_borrow))
     
-    if available_books and active_users:
+    if has_books and has_users:
         # Select user
-        username_list = list(active_users.keys())
-        selected_username = st.selectbox("Select User", username_list)
-        
+        selected_username = typeahead("Select User", lambda query, limit: search_users(query, limit, where=can_borrow),
+                                      lambda username: user_label(username, users[username]), key="issue_user")
+    
+    if has_books and has_users and selected_username is not None:
         # Count books already issued to this user
-        user_issues = [issue for issue in issues if issue['username'] == selected_username and issue['return_date'] is None]
+        user_issues = [issue for issue in repo.issues_for_user(selected_username) if issue['return_date'] is None]
         max_books = settings['max_books_per_user']
         
         if len(user_issues) >= max_books:
@@ -75,9 +74,8 @@ with tab1:
             st.write(f"User has {len(user_issues)} books out of {max_books} maximum")
             
             # Select book
-            book_titles = {book['title']: book['id'] for book in available_books}
-            selected_title = st.selectbox("Select Book", list(book_titles.keys()))
-            selected_book_id = book_titles[selected_title]
+            selected_book_id = typeahead("Select Book", lambda query, limit: search_books(query, limit, where=is_available),
+                                         lambda book_id: book_label(repo.book(book_id)), key="issue_book")
             
             # Set issue date and expected return date
             issue_date = st.date_input("Issue Date", datetime.now())
@@ -85,72 +83,48 @@ with tab1:
             expected_return = issue_date + timedelta(days=loan_period)
             st.write(f"Expected Return Date: {expected_return.strftime('%Y-%m-%d')}")
             
-            if st.button("Issue Book"):
-                # Update book availability
-                for book in books:
-                    if book['id'] == selected_book_id:
-                        book['available'] -= 1
-                        break
-                
-                # Create new issue record
-                new_issue = {
-                    'username': selected_username,
-                    'book_id': selected_book_id,
-                    'issue_date': issue_date.strftime('%Y-%m-%d'),
-                    'expected_return_date': expected_return.strftime('%Y-%m-%d'),
-                    'return_date': None,
-                    'fine_paid': 0.0,
-                    'status': 'issued'
-                }
-                
-                issues.append(new_issue)
-                
-                # Save data
-                save_books(books)
-                save_issues(issues)
-                
-                st.success(f"Book '{selected_title}' issued to {selected_username} successfully")
-                st.rerun()
-    else:
-        if not available_books:
+            if selected_book_id is not None and st.button("Issue Book"):
+                # Stock, the user's limit and the new issue are checked and saved as one
+                # transaction, so another desk can't take the same last copy meanwhile
+                try:
+                    new_issue = issue_book(selected_username, selected_book_id, issue_date)
+                except CirculationError as e:
+                    st.error(str(e))
+                else:
+                    book = repo.book(selected_book_id)
+                    st.success(f"Book '{book['title']}' issued to {selected_username} successfully (Issue ID {new_issue['id']})")
+                    st.rerun()
+    elif not (has_books and has_users):
+        if not has_books:
             st.warning("No books available to issue")
-        if not active_users:
+        if not has_users:
             st.warning("No active users to issue books to")
 
 # Return Book Tab
 with tab2:
     st.header("Return Book")
     
-    # Load data
-    books = load_books()
-    users = load_users()
-    issues = load_issues()
+    # Load data (only the rows on screen are read)
     settings = load_settings()
     
-    # Filter current issues
-    current_issues = [issue for issue in issues if issue['return_date'] is None]
+    def issue_label(issue_id):
+        candidate = read_record('issues', issue_id)
+        book = read_record('books', candidate['book_id'])
+        user = read_record('users', candidate['username'])
+        if not (book and user):
+            return f"#{issue_id}"
+        return f"#{issue_id} {user['first_name']} {user['last_name']} - {book['title']} (Issued: {candidate['issue_date']})"
     
-    if current_issues:
-        # Create a readable list of issues for selection
-        issue_options = []
-        issue_map = {}
-        
-        for i, issue in enumerate(current_issues):
-            book = next((b for b in books if b['id'] == issue['book_id']), None)
-            user = users.get(issue['username'], None)
-            
-            if book and user:
-                option = f"{user['first_name']} {user['last_name']} - {book['title']} (Issued: {issue['issue_date']})"
-                issue_options.append(option)
-                issue_map[option] = i
-        
-        selected_issue_option = st.selectbox("Select Issue to Return", issue_options)
-        selected_issue_index = issue_map[selected_issue_option]
-        issue = current_issues[selected_issue_index]
-        
+    # A scanned issue ID (or book ISBN) goes straight to the loan through the index;
+    # anything else is matched against borrowers and titles
+    selected_issue_id = typeahead("Scan Issue ID or Book ISBN, or search by borrower or title",
+                                  search_open_issues, issue_label, key="return_issue")
+    issue = read_record('issues', selected_issue_id) if selected_issue_id is not None else None
+    
+    if issue:
         # Get book and user details
-        book = next((b for b in books if b['id'] == issue['book_id']), None)
-        user = users.get(issue['username'], None)
+        book = read_record('books', issue['book_id'])
+        user = read_record('users', issue['username'])
         
         if book and user:
             st.write(f"Book: {book['title']}")
@@ -160,39 +134,40 @@ with tab2:
             
             # Calculate fine if overdue
             return_date = st.date_input("Return Date", datetime.now())
-            expected_return_date = datetime.strptime(issue['expected_return_date'], '%Y-%m-%d').date()
+            days_late = days_overdue(issue, return_date)
             
-            if return_date > expected_return_date:
-                days_overdue = (return_date - expected_return_date).days
+            if days_late > 0:
                 fine_rate = settings['fine_per_day']
-                fine_amount = days_overdue * fine_rate
+                fine_amount = days_late * fine_rate
                 
-                st.warning(f"Book is overdue by {days_overdue} days")
+                st.warning(f"Book is overdue by {days_late} days")
                 st.write(f"Fine Amount: ${fine_amount:.2f}")
                 
                 fine_paid = st.number_input("Fine Paid", min_value=0.0, max_value=float(fine_amount), value=float(fine_amount), step=0.5)
             else:
                 fine_paid = 0.0
             
-            if st.button("Return Book"):
-                # Update issue record
-                issue['return_date'] = return_date.strftime('%Y-%m-%d')
-                issue['fine_paid'] = fine_paid
-                issue['status'] = 'returned'
-                
-                # Update book availability
-                for b in books:
-                    if b['id'] == book['id']:
-                        b['available'] += 1
-                        break
-                
-                # Save data
-                save_books(books)
-                save_issues(issues)
-                
-                st.success(f"Book '{book['title']}' returned successfully")
-                st.rerun()
-    else:
+            return_col, renew_col = st.columns(2)
+            
+            if return_col.button("Return Book"):
+                # Save the returned issue and its book together
+                try:
+                    return_book(issue['id'], return_date, fine_paid)
+                except CirculationError as e:
+                    st.error(str(e))
+                else:
+                    st.success(f"Book '{book['title']}' returned successfully")
+                    st.rerun()
+            
+            if days_late <= 0 and renew_col.button("Renew Loan"):
+                try:
+                    renewed = renew_issue(issue['id'])
+                except CirculationError as e:
+                    st.error(str(e))
+                else:
+                    st.success(f"Loan renewed: '{book['title']}' is now due on {renewed['expected_return_date']}")
+                    st.rerun()
+    elif not get_repository().count_open():
         st.info("No books currently issued")
 
 # Current Issues Tab
@@ -200,32 +175,28 @@ with tab3:
     st.header("Current Issues")
     
     # Load data
-    books = load_books()
-    users = load_users()
-    issues = load_issues()
+    repo = get_repository()
     settings = load_settings()
     
-    # Filter current issues
-    current_issues = [issue for issue in issues if issue['return_date'] is None]
+    today = datetime.now().date()
     
-    if current_issues:
-        # Create list for DataFrame
-        issues_list = []
+    # Build display rows for a list of issues
+    def issue_rows(issues):
+        rows = []
         
-        for issue in current_issues:
-            book = next((b for b in books if b['id'] == issue['book_id']), None)
-            user = users.get(issue['username'], None)
+        for issue in issues:
+            book = repo.book(issue['book_id'])
+            user = repo.user(issue['username'])
             
             if book and user:
                 # Calculate days until due or overdue
-                today = datetime.now().date()
-                expected_return_date = datetime.strptime(issue['expected_return_date'], '%Y-%m-%d').date()
-                days_diff = (expected_return_date - today).days
+                days_late = days_overdue(issue, today)
                 
-                status = "Overdue" if days_diff < 0 else "Due"
-                days_text = f"{abs(days_diff)} days {'overdue' if days_diff < 0 else 'left'}"
+                status = "Overdue" if days_late > 0 else "Due"
+                days_text = f"{abs(days_late)} days {'overdue' if days_late > 0 else 'left'}"
                 
-                issues_list.append({
+                rows.append({
+                    'Issue ID': issue['id'],
                     'User': f"{user['first_name']} {user['last_name']}",
                     'Book': book['title'],
                     'Issue Date': issue['issue_date'],
@@ -234,19 +205,32 @@ with tab3:
                     'Days': days_text
                 })
         
-        # Convert to DataFrame and display
-        df = pd.DataFrame(issues_list)
-        st.dataframe(df, use_container_width=True)
+        return rows
+    
+    if repo.count_open():
+        # Open issues matching the filter, sorted and paged from the open-issue view
+        search = st.text_input("Filter by issue ID, ISBN, borrower or title")
+        matches = search_open_issues(search) if search else None
+        
+        def fetch_issues(offset, limit, sort, descending):
+            total, issue_ids = page_ids('issues', offset, limit, sort, descending, where=is_open, matches=matches)
+            return total, issue_rows(repo.issue(issue_id) for issue_id in issue_ids)
+        
+        sort_options = {"Issue ID": None, "Due Date": 'expected_return_date',
+                        "Issue Date": 'issue_date', "Username": 'username'}
+        paged_table("current_issues", fetch_issues, sort_options, empty="No matching issues")
         
-        # Overdue items summary
-        overdue_issues = [i for i in issues_list if i['Status'] == 'Overdue']
-        if overdue_issues:
+        # Overdue items summary, most overdue first (from the due-date index)
+        overdue_count = repo.count_overdue(today)
+        if overdue_count:
             st.subheader("Overdue Summary")
-            st.warning(f"{len(overdue_issues)} books are currently overdue")
+            st.warning(f"{overdue_count} books are currently overdue")
             
             # Display overdue books
-            df_overdue = pd.DataFrame(overdue_issues)
-            st.dataframe(df_overdue, use_container_width=True)
+            def fetch_overdue(offset, limit, sort, descending):
+                return overdue_count, issue_rows(repo.overdue_issues(today, limit, offset))
+            
+            paged_table("overdue_issues", fetch_overdue)
     else:
         st.info("No books currently issued")
 
@@ -1,8 +1,6 @@
 import streamlit as st
 import pandas as pd
 import pickle
-from datetime import datetime
-from pathlib import Path
 import sys
 import os
 
@@ -10,11 +8,17 @@ import os
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 sys.path.append(parent_dir)
 
-# Import from app.py
-from app import (
+# Import the shared data layer and page helpers
+from core import (
     load_settings, save_settings,
-    sidebar_nav
+    rebuild_stats,
+    get_archive, run_archive_policy,
+    get_audit_log, run_audit_retention,
+    get_backups, start_backup, backup_progress, legacy_backups, restore_backup
 )
+from core.audit import COMPRESSIONS as AUDIT_COMPRESSIONS
+from core.auth import require_admin
+from core.ui import apply_styles, sidebar_nav
 
 # Set page configuration
 st.set_page_config(
@@ -24,27 +28,21 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Redirect if not logged in
-if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
-    st.warning("Please login to access this page")
-    st.switch_page("app.py")
+# Redirect unless logged in as admin
+require_admin()
 
-# Check if admin
-if st.session_state['role'] != 'admin':
-    st.error("You don't have permission to access this page")
-    st.switch_page("app.py")
-
-# Show sidebar navigation
+# Custom CSS and sidebar navigation
+apply_styles()
 sidebar_nav()
 
 # Main content
 st.title("Settings & Preferences")
 
-# Load settings
-settings = load_settings()
+# Load settings (copied, since the loaded dict is shared)
+settings = dict(load_settings())
 
 # Tabs for different settings
-tab1, tab2, tab3 = st.tabs(["Library Info", "Fine Rules", "Backup/Restore"])
+tab1, tab2, tab3, tab4 = st.tabs(["Library Info", "Fine Rules", "Backup/Restore", "Maintenance"])
 
 # Library Info Tab
 with tab1:
@@ -97,97 +95,99 @@ with tab3:
     
     # Backup functionality
     st.subheader("Backup Database")
+    st.write("Backups are stored as compressed chunks, and a chunk already kept by an earlier backup is not stored again. The issue archive is included.")
     
     if st.button("Create Backup"):
-        # Get data
-        DATA_DIR = Path(__file__).parent.parent / "data"
-        USERS_FILE = DATA_DIR / "users.pkl"
-        BOOKS_FILE = DATA_DIR / "books.pkl"
-        ISSUES_FILE = DATA_DIR / "issues.pkl"
-        SETTINGS_FILE = DATA_DIR / "settings.pkl"
-        
-        # Create backup directory if it doesn't exist
-        BACKUP_DIR = DATA_DIR / "backups"
-        BACKUP_DIR.mkdir(exist_ok=True)
-        
-        # Create backup timestamp
-        timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        
-        # Create backup files
-        import shutil
-        
-        try:
-            if USERS_FILE.exists():
-                shutil.copy(USERS_FILE, BACKUP_DIR / f"users_{timestamp}.pkl")
-            
-            if BOOKS_FILE.exists():
-                shutil.copy(BOOKS_FILE, BACKUP_DIR / f"books_{timestamp}.pkl")
-            
-            if ISSUES_FILE.exists():
-                shutil.copy(ISSUES_FILE, BACKUP_DIR / f"issues_{timestamp}.pkl")
-            
-            if SETTINGS_FILE.exists():
-                shutil.copy(SETTINGS_FILE, BACKUP_DIR / f"settings_{timestamp}.pkl")
-            
-            st.success(f"Backup created successfully: {timestamp}")
-        except Exception as e:
-            st.error(f"Backup failed: {str(e)}")
+        start_backup()
+    
+    # Backups run in the background; this part of the page refreshes itself while one does
+    @st.fragment(run_every=1)
+    def backup_status():
+        progress = backup_progress()
+        if progress is None:
+            return
+        if not progress.finished:
+            st.progress(progress.fraction, text=f"{progress.stage} ({progress.done}/{progress.total})" if progress.total else progress.stage)
+        elif progress.error:
+            st.error(f"Backup failed: {progress.error}")
+        else:
+            manifest = get_backups().manifest(progress.backup_id)
+            st.success(f"Backup created successfully: {progress.backup_id} "
+                       f"({manifest['new_chunks']} of {manifest['chunks']} chunks new, {manifest['stored_bytes'] / 1024:.1f} KB stored)")
+    
+    backup_status()
     
     # Restore functionality
     st.subheader("Restore Database")
     
-    # Get backup files
-    DATA_DIR = Path(__file__).parent.parent / "data"
-    BACKUP_DIR = DATA_DIR / "backups"
+    backup_list = get_backups().backups()
+    old_backups = legacy_backups()
     
-    if BACKUP_DIR.exists():
-        backup_timestamps = set()
-        
-        for file in BACKUP_DIR.glob("*_*.pkl"):
-            parts = file.name.split("_")
-            if len(parts) >= 3:
-                date_part = parts[-3]
-                time_part = parts[-2]
-                timestamp = f"{date_part}_{time_part}"
-                backup_timestamps.add(timestamp)
+    if backup_list or old_backups:
+        labels = {backup_id: backup_id for backup_id in backup_list}
+        labels.update({backup_id: f"{backup_id} (pickle copy)" for backup_id in old_backups})
+        selected_backup = st.selectbox("Select Backup to Restore", list(labels), format_func=labels.get)
         
-        if backup_timestamps:
-            backup_list = sorted(list(backup_timestamps), reverse=True)
-            selected_backup = st.selectbox("Select Backup to Restore", backup_list)
-            
-            if st.button("Restore Selected Backup"):
-                # Get data files
-                USERS_FILE = DATA_DIR / "users.pkl"
-                BOOKS_FILE = DATA_DIR / "books.pkl"
-                ISSUES_FILE = DATA_DIR / "issues.pkl"
-                SETTINGS_FILE = DATA_DIR / "settings.pkl"
-                
-                # Get backup files
-                USERS_BACKUP = BACKUP_DIR / f"users_{selected_backup}.pkl"
-                BOOKS_BACKUP = BACKUP_DIR / f"books_{selected_backup}.pkl"
-                ISSUES_BACKUP = BACKUP_DIR / f"issues_{selected_backup}.pkl"
-                SETTINGS_BACKUP = BACKUP_DIR / f"settings_{selected_backup}.pkl"
-                
-                # Restore files
-                import shutil
-                
-                try:
-                    if USERS_BACKUP.exists():
-                        shutil.copy(USERS_BACKUP, USERS_FILE)
-                    
-                    if BOOKS_BACKUP.exists():
-                        shutil.copy(BOOKS_BACKUP, BOOKS_FILE)
-                    
-                    if ISSUES_BACKUP.exists():
-                        shutil.copy(ISSUES_BACKUP, ISSUES_FILE)
-                    
-                    if SETTINGS_BACKUP.exists():
-                        shutil.copy(SETTINGS_BACKUP, SETTINGS_FILE)
-                    
-                    st.success(f"Backup '{selected_backup}' restored successfully")
-                except Exception as e:
-                    st.error(f"Restore failed: {str(e)}")
-        else:
-            st.info("No backups available")
+        if st.button("Restore Selected Backup"):
+            try:
+                restore_backup(selected_backup)
+                st.success(f"Backup '{selected_backup}' restored successfully")
+            except Exception as e:
+                st.error(f"Restore failed: {str(e)}")
     else:
-        st.info("No backups available")
\ No newline at end of file
+        st.info("No backups available")
+
+# Maintenance Tab
+with tab4:
+    st.header("Maintenance")
+    
+    # Dashboard counters are updated with every change; this recounts them from the data
+    st.subheader("Dashboard Counters")
+    st.write("Recalculate Total Books, Active Users, Books on Loan and Overdue Books from the full data.")
+    
+    if st.button("Recalculate Dashboard Counters"):
+        rebuild_stats()
+        st.success("Dashboard counters recalculated successfully")
+    
+    # Returned loans are only needed by reports, which also read the archive
+    st.subheader("Issue Archive")
+    st.write("Returned loans are moved out of the circulation data into the monthly issue archive by a background job. Reports still include them.")
+    st.write(f"Archived months: {len(get_archive().months())}")
+    
+    archive_after_days = st.number_input("Archive returned loans older than (days, 0 = never)", min_value=0, value=int(settings['archive_after_days']))
+    
+    if st.button("Save Archive Policy"):
+        settings['archive_after_days'] = archive_after_days
+        save_settings(settings)
+        st.success("Archive policy updated successfully")
+    
+    if st.button("Run Archival Now"):
+        archived_count = run_archive_policy()
+        st.success(f"{archived_count} returned loans archived")
+    
+    # Old audit log days are compressed, and optionally rolled up into daily counts
+    st.subheader("Audit Log Retention")
+    st.write("A background job compresses audit log days past the hot period and can reduce very old days to a count of each action per user. The Audit Logs page still shows them.")
+    
+    usage = get_audit_log().disk_usage()
+    col1, col2, col3 = st.columns(3)
+    for col, group, label in [(col1, 'hot', "Uncompressed"), (col2, 'compressed', "Compressed"), (col3, 'rollup', "Rolled Up")]:
+        days, size = usage.get(group, (0, 0))
+        with col:
+            st.metric(f"{label} Days", days, help=f"{size / 1024:.1f} KB on disk")
+    
+    compressions = list(AUDIT_COMPRESSIONS)
+    audit_hot_days = st.number_input("Compress audit log days older than (days, 0 = never)", min_value=0, value=int(settings['audit_hot_days']))
+    audit_compression = st.selectbox("Compression", compressions, index=compressions.index(settings['audit_compression']) if settings['audit_compression'] in compressions else 0)
+    audit_rollup_days = st.number_input("Roll up audit log days older than (days, 0 = never) into daily counts", min_value=0, value=int(settings['audit_rollup_days']))
+    
+    if st.button("Save Retention Policy"):
+        settings['audit_hot_days'] = audit_hot_days
+        settings['audit_compression'] = audit_compression
+        settings['audit_rollup_days'] = audit_rollup_days
+        save_settings(settings)
+        st.success("Retention policy updated successfully")
+    
+    if st.button("Apply Retention Now"):
+        compacted_count = run_audit_retention()
+        st.success(f"{compacted_count} audit log days compacted")
@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+APP_DIR = Path(__file__).resolve().parent.parent / "library_app"
+
+# Each process opens the data directory of its own copy of the app
+PREAMBLE = """
+import sys
+sys.path.insert(0, {app!r})
+import core
+core.disable_archiver()
+"""
+
+# A desk that is already running when another process lends three books in
+# January, takes them back and archives those loans; then the desk lends again
+DESK = """
+core.get_storage()
+Path({ready!r}).touch()
+while not Path({archived!r}).exists():
+    time.sleep(0.05)
+print(core.issue_book('reader', 1)['id'])
+"""
+
+LEND_AND_ARCHIVE = """
+from datetime import date
+storage = core.get_storage()
+storage.apply({{'users': ([('reader', dict(core.read_record('users', 'admin'), role='user', active=True))], [])}})
+for book_id in (1, 2, 3):
+    issue = core.issue_book('reader', book_id, date(2024, 1, book_id))
+    core.return_book(issue['id'], date(2024, 1, 10))
+print(core.archive_issues())
+"""
+
+# A loan stored under an id the archive already holds for another loan, as
+# older versions could hand out, is returned and archived
+CLASH = """
+from datetime import date
+storage = core.get_storage()
+clash = dict(id=2, username='admin', book_id=2, issue_date=date(2024, 3, 1),
+             expected_return_date=date(2024, 3, 15), return_date=date(2024, 3, 5), fine_paid=0.0, status='returned')
+storage.apply({{'issues': ([(2, clash)], [])}})
+print(core.archive_issues())
+"""
+
+REPORT = """
+import json
+reports = core.get_reports()
+print(json.dumps({{'archived': sorted(core.get_archive().read(['id']).column('id').to_pylist()),
+                  'open': sorted(issue['id'] for issue in core.load_issues()),
+                  'loans': reports.issue_count()}}))
+"""
+
+
+def _script(app, body, **paths):
+    return PREAMBLE.format(app=str(app)) + "import time\nfrom pathlib import Path\n" + body.format(**paths)
+
+
+@pytest.fixture
+def app(tmp_path):
+    shutil.copytree(APP_DIR, tmp_path / "library_app", ignore=shutil.ignore_patterns('data', '__pycache__'))
+    return tmp_path / "library_app"
+
+
+@pytest.mark.parametrize('backend', ['pickle', 'sqlite'])
+def test_archived_ids_are_not_issued_again(app, tmp_path, backend):
+    env = dict(os.environ, LIBRARY_STORAGE=backend)
+    ready, archived = tmp_path / "ready", tmp_path / "archived"
+    desk = subprocess.Popen([sys.executable, '-c', _script(app, DESK, ready=str(ready), archived=str(archived))],
+                            stdout=subprocess.PIPE, text=True, env=env)
+    deadline = time.time() + 60
+    while not ready.exists():
+        assert desk.poll() is None and time.time() < deadline
+        time.sleep(0.05)
+
+    moved = subprocess.run([sys.executable, '-c', _script(app, LEND_AND_ARCHIVE)],
+                           capture_output=True, text=True, env=env, check=True)
+    assert moved.stdout.split()[-1] == '3'
+    archived.touch()
+
+    new_id = int(desk.communicate(timeout=60)[0].split()[-1])
+    assert desk.returncode == 0
+    report = subprocess.run([sys.executable, '-c', _script(app, REPORT)],
+                            capture_output=True, text=True, env=env, check=True)
+    state = json.loads(report.stdout.splitlines()[-1])
+    assert state['archived'] == [1, 2, 3]
+    assert new_id not in state['archived']
+    assert state['open'] == [new_id]
+    assert state['loans'] == 4
+
+
+@pytest.mark.parametrize('backend', ['pickle', 'sqlite'])
+def test_loan_with_an_archived_id_is_archived_under_a_new_one(app, backend):
+    env = dict(os.environ, LIBRARY_STORAGE=backend)
+    subprocess.run([sys.executable, '-c', _script(app, LEND_AND_ARCHIVE)], capture_output=True, env=env, check=True)
+    moved = subprocess.run([sys.executable, '-c', _script(app, CLASH)],
+                           capture_output=True, text=True, env=env, check=True)
+    assert moved.stdout.split()[-1] == '1'
+    report = subprocess.run([sys.executable, '-c', _script(app, REPORT)],
+                            capture_output=True, text=True, env=env, check=True)
+    state = json.loads(report.stdout.splitlines()[-1])
+    assert state['archived'] == [1, 2, 3, 4]
+    assert state['open'] == []
+    assert state['loans'] == 4
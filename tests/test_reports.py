@@ -0,0 +1,37 @@
+import sys
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "library_app"))
+
+from core.archive import IssueArchive
+from core.reports import Reports, books_frame, issues_frame, users_frame
+
+
+def _issue(issue_id, book_id, day, returned):
+    return {
+        'id': issue_id,
+        'username': 'reader',
+        'book_id': book_id,
+        'issue_date': date(2024, 1, day),
+        'expected_return_date': date(2024, 1, day + 14),
+        'return_date': date(2024, 1, day + 7) if returned else None,
+        'fine_paid': 0.0,
+        'status': 'returned' if returned else 'issued',
+    }
+
+
+def test_loan_in_archive_and_row_store_counts_once(tmp_path):
+    books = [{'id': book_id, 'title': f"Title {book_id}", 'author': "Author", 'category': "Fiction",
+              'stock': 1, 'available': 1, 'added_on': date(2024, 1, 1)} for book_id in (1, 2, 3, 4)]
+    users = {'reader': {'first_name': "Some", 'last_name': "Reader", 'email': "reader@example.com"}}
+    archive = IssueArchive(tmp_path / "archive")
+    archive.append([_issue(1, 1, 1, True), _issue(2, 2, 2, True), _issue(3, 3, 3, True)])
+    # Loan 2 has been written to the archive but not yet removed from the row store
+    issues = [_issue(2, 2, 2, True), _issue(4, 4, 4, False)]
+    reports = Reports(issues_frame(issues), books_frame(books), users_frame(users), archive)
+
+    rows, summary = reports.lending_history(date(2024, 1, 1), date(2024, 1, 31))
+    assert reports.issue_count() == 4
+    assert summary['total'] == 4
+    assert len(rows) == 4